@@ -1,4 +1,5 @@
 from quarto import *
+from quarto_tournament import Tournament
 import quarto_agents as qagents
 import multiprocessing as mp
 import os
@@ -15,12 +16,13 @@ def mpListener(filename, q):
             f.flush()
 
 def batchRunInstance(num_times, agent1, agent2, q):
-    game = QuartoGame(agent1, agent2, gui_mode=False, bin_mode=False)
+    game = QuartoGame(agent1, agent2, gui_mode=False, bin_mode=False, log_stats=True)
 
     for _ in range(num_times):
-        result = game.playRandomFirst()
+        result = game.play()
         q.put(f"{result},{round(game.agent1_cumulative_time,4)},{round(game.agent2_cumulative_time,4)},{game.numMoves1},{game.numMoves2}")
         game.resetGame()
+        game.resetStats()
 
 #multiprocessing batch running of games between two agents
 def mpBatchRun(agent1: qagents.GenericQuartoAgent, agent2: qagents.GenericQuartoAgent, gamesPerCPU: int, cpu_count: int):
@@ -56,6 +58,7 @@ def mpBatchRun(agent1: qagents.GenericQuartoAgent, agent2: qagents.GenericQuarto
     pool.close()
     pool.join()
 
+#every configuration plays the control agent in both seat orders, as one tournament on one pool
 def negamax_tests():
     #search window and depth values
     negamax_search = [16]
@@ -65,18 +68,14 @@ def negamax_tests():
     geneticminmax = qagents.GeneticMinmaxAgent(searchDepth=3, maxGenerations=2, initialPopulationSize=5000, maxPopulationSize=6000)
     geneticminmax.setName("ControlGenetic-3")
 
-    for s in negamax_search:
-        for d in negamax_depths:
-            negamax_agent = qagents.NegamaxAgent(depth=d, searchWindow=s)
+    agents = [geneticminmax] + [qagents.NegamaxAgent(depth=d, searchWindow=s) for s in negamax_search for d in negamax_depths]
+    tournament = Tournament("negamax_tests", agents, gamesPerPairing=48, pairings=[(0, i) for i in range(1, len(agents))])
 
-            start_time = time.time()
-            #half the runs as player 1
-            mpBatchRun(negamax_agent, geneticminmax, 12, 4)
-            end_time = time.time()
-            print("Batch run time: ", round(end_time - start_time,4))
-
-            #half the runs as player 2
-            mpBatchRun(geneticminmax, negamax_agent, 12, 4)
+    start_time = time.time()
+    tournament.run(4)
+    end_time = time.time()
+    print("Batch run time: ", round(end_time - start_time,4))
+    tournament.writeRunFiles()
 
 def genetic_tests():
     #hyperparameters
@@ -88,18 +87,17 @@ def genetic_tests():
     negamax_agent = qagents.NegamaxAgent(depth=3, searchWindow=16)
     negamax_agent.setName("ControlNegamax-3")
 
-    for g in genetic_gens:
-        for d in genetic_depths:
-            geneticminmax = qagents.GeneticMinmaxAgent(searchDepth=d, maxGenerations=g, initialPopulationSize=initial_population, maxPopulationSize=max_population)
-
-            start_time = time.time()
-            #half the runs as player 1
-            mpBatchRun(geneticminmax, negamax_agent, 13, 4)
-            end_time = time.time()
-            print("Batch run time: ", round(end_time - start_time,4))
+    agents = [negamax_agent] + [
+        qagents.GeneticMinmaxAgent(searchDepth=d, maxGenerations=g, initialPopulationSize=initial_population, maxPopulationSize=max_population)
+        for g in genetic_gens for d in genetic_depths
+    ]
+    tournament = Tournament("genetic_tests", agents, gamesPerPairing=52, pairings=[(0, i) for i in range(1, len(agents))])
 
-            #half the runs as player 2
-            mpBatchRun(negamax_agent, geneticminmax, 13, 4)
+    start_time = time.time()
+    tournament.run(4)
+    end_time = time.time()
+    print("Batch run time: ", round(end_time - start_time,4))
+    tournament.writeRunFiles()
 
 def vs_tests():
     #history neg - (3,16), (3,32)
@@ -109,6 +107,7 @@ def vs_tests():
     negamax_params = [(3,32)]
     genetic_params = [(3,2,8000,12000)]
 
+    agents, pairings = [], []
     for p in range(len(negamax_params)):
         negamax_param = negamax_params[p]
         negamax_agent = qagents.NegamaxAgent(depth=negamax_param[0], searchWindow=negamax_param[1])
@@ -117,14 +116,44 @@ def vs_tests():
         d, g, initial_population, max_population = genetic_param
         geneticminmax = qagents.GeneticMinmaxAgent(searchDepth=d, maxGenerations=g, initialPopulationSize=initial_population, maxPopulationSize=max_population)
 
-        start_time = time.time()
-        #half the runs as player 1
-        mpBatchRun(geneticminmax, negamax_agent, 5, 4)
-        end_time = time.time()
-        print("Batch run time: ", round(end_time - start_time,4))
-
-        #half the runs as player 2
-        mpBatchRun(negamax_agent, geneticminmax, 5, 4)
+        pairings.append((len(agents), len(agents) + 1))
+        agents += [geneticminmax, negamax_agent]
+
+    tournament = Tournament("vs_tests", agents, gamesPerPairing=20, pairings=pairings)
+
+    start_time = time.time()
+    tournament.run(4)
+    end_time = time.time()
+    print("Batch run time: ", round(end_time - start_time,4))
+    tournament.writeRunFiles()
+
+#checks that the parallel root split returns the serial search's move at a fixed depth, from the same ordering state
+def parallel_search_tests(depth=3, searchWindow=16, workers=4, numPositions=30, numEmpty=11):
+    parallel_agent = qagents.NegamaxAgent(depth=depth, searchWindow=searchWindow, workers=workers)
+    serial_agent = qagents.NegamaxAgent(depth=depth, searchWindow=searchWindow)
+
+    mismatches = 0
+    positions = 0
+    while positions < numPositions:
+        #random position with numEmpty empty cells that is not decided yet
+        state = qutil.Bitboard()
+        state.makeFirstMove(int(np.random.randint(16)))
+        while state.numEmpty() > numEmpty and not state.isGameOver():
+            state.makeMove(int(np.random.choice(state.availablePositions())), int(np.random.choice(state.availablePieces())))
+        if state.isGameOver() or state.winningPositions(state.currentPiece):
+            continue
+        positions += 1
+
+        serial_agent.setOrdering(parallel_agent.history)
+        serial_move = serial_agent.makeMove(state.toState())
+        parallel_move = parallel_agent.makeMove(state.toState())
+        if serial_move != parallel_move:
+            mismatches += 1
+            print(f"{state.toEncoding()}: serial {serial_move}, parallel {parallel_move}")
+
+    parallel_agent.closePool()
+    print(f"{mismatches} of {numPositions} parallel searches differ from the serial search")
+    return mismatches
 
 #Opens up all files in the directory and summarizes data in graphs and tables
 def create_table(path_to_dir: str):
@@ -186,11 +215,12 @@ def main():
     # negamax= qagents.NegamaxAgent(depth=3, searchWindow=32)
     #game = QuartoGame(negamax, geneticminmax, gui_mode=True, bin_mode=False)
     game = QuartoGame(qagents.NegamaxAgent(depth=3, searchWindow=32), geneticminmax, gui_mode=True, bin_mode=False)
-    game.playRandomFirst()
+    game.play()
     
     #negamax_tests()
     #genetic_tests()
     #vs_tests()
+    #parallel_search_tests()
     #create_table('experiment_results/final/')
     pass
           
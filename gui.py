@@ -125,10 +125,10 @@ class QuartoGUI(tk.Tk):
         if nextPiece not in range(16):
             self.display2['text'] = "This piece does not exist"
             return False
-        if position not in self._game.availablePositions:
+        if self._game.state.occupied >> position & 1:
             self.display2['text'] = "This cell is unavailable"
             return False
-        if nextPiece not in self._game.availablePieces:
+        if not self._game.state.pieces >> nextPiece & 1:
             self.display2['text'] = "This piece is not available"
             return False
         
@@ -137,14 +137,10 @@ class QuartoGUI(tk.Tk):
         
         #place piece on board and update game state
         self.update_cell(position)
-        row, col = qutil.get2dCoords(position)
-        self._game.board[row][col] = self._game.currentPiece
-        self._game.availablePositions.remove(position)
+        self._game.state.makeMove(position, nextPiece)
 
         #set next player's piece
         self.update_current(nextPiece)
-        self._game.currentPiece = nextPiece
-        self._game.availablePieces.remove(self._game.currentPiece)
 
         if self._game.gui_mode: print("Move successful")
         return True   
@@ -155,7 +151,7 @@ class QuartoGUI(tk.Tk):
 
         # first move
         self.display2['text'] = "Pick the first piece"
-        first_move = self._game.player1.makeFirstMove(self._game.getGameState())
+        first_move = self._game.player1.makeFirstMove(self._game.getAgentState(self._game.player1))
         self._game.makeFirstMove(first_move)
         self.update_current(first_move)
         turn = False 
@@ -163,7 +159,7 @@ class QuartoGUI(tk.Tk):
         if self._game.gui_mode: self._game.showGameState()
 
         # subsequent moves
-        for i in range(len(self._game.availablePositions)-1):
+        for i in range(self._game.state.numEmpty()-1):
             if self._game.gui_mode: self._game.showPlayerName(turn)
 
             # player 1
@@ -172,7 +168,7 @@ class QuartoGUI(tk.Tk):
                 self.display2['text'] = "Agent is playing..."
 
                 for i in range(3):
-                    position, nextPiece = self._game.player1.makeMove(self._game.getGameState())
+                    position, nextPiece = self._game.player1.makeMove(self._game.getAgentState(self._game.player1))
                     validMove = self.makeMove(position, nextPiece)
                     if validMove:
                         break
@@ -185,7 +181,7 @@ class QuartoGUI(tk.Tk):
                 self.display2['text'] = "Agent is playing..."
 
                 for i in range(3):
-                    position, nextPiece = self._game.player2.makeMove(self._game.getGameState())
+                    position, nextPiece = self._game.player2.makeMove(self._game.getAgentState(self._game.player2))
                     validMove = self.makeMove(position, nextPiece)
                     if validMove:
                         break
@@ -195,7 +191,7 @@ class QuartoGUI(tk.Tk):
 
             if self._game.gui_mode: self._game.showGameState()
 
-            if (qutil.isGameOver(self._game.board)):
+            if (self._game.state.isGameOver()):
                 if turn: 
                     self.display['text'] = "Player 1 Won!"
                     self.display2['text'] = ""
@@ -211,7 +207,7 @@ class QuartoGUI(tk.Tk):
 
         if self._game.gui_mode: self._game.showGameState()
 
-        if (qutil.isGameOver(self._game.board)):
+        if (self._game.state.isGameOver()):
             if turn: 
                 self.display['text'] = "Player 1 Won!"
                 self.display2['text'] = ""
@@ -28,6 +28,9 @@ class QuartoGame:
         self.log_stats = log_stats
         self.numRetriesAllowed = numRetriesAllowed
 
+        # detailed move log, only opened by playMultipleGames
+        self.detailedLogFile = None
+
         # game state
         self.moveHistory = list()
         self.resetGame()
@@ -43,10 +46,7 @@ class QuartoGame:
         ), "Agent 2 is not initialized correctly."
 
     def resetGame(self):
-        self.board = np.full((4, 4), 16)
-        self.currentPiece = 16  # set to nothing upon starting
-        self.availablePieces = set(range(16))
-        self.availablePositions = set(range(16))
+        self.state = qutil.Bitboard()  # current piece is set to nothing upon starting
         self.moveHistory.clear()
 
     def resetStats(self):
@@ -55,8 +55,25 @@ class QuartoGame:
         self.numMoves1 = 0
         self.numMoves2 = 0
 
+    # the bitboard is the game state - the properties below are views of it for display and the agent API
+    @property
+    def board(self):
+        return self.state.toBoard()
+
+    @property
+    def currentPiece(self):
+        return self.state.currentPiece
+
+    @property
+    def availablePieces(self):
+        return set(self.state.availablePieces())
+
+    @property
+    def availablePositions(self):
+        return set(self.state.availablePositions())
+
     def encodeBoard(self):
-        return qutil.encodeBoard(self.board, self.currentPiece)
+        return self.state.toEncoding()
 
     def setPlayerNames(self, name1, name2):
         self.player1Name = self.player1.name if self.player1.name is not None else name1
@@ -69,12 +86,12 @@ class QuartoGame:
             print(f"\n ------{self.player2Name}'s Turn---------\n")
 
     def __getPieceToShow(self, i, j):
-        piece = str(self.board[i][j])
+        piece = str(self.state.getPiece(qutil.getLinearCoords(i, j)))
         if self.bin_mode:
             if piece == "16":
                 piece = f"({qutil.getLinearCoords(i,j)})"
             else:
-                piece = f"{self.board[i][j]:04b}"
+                piece = f"{int(piece):04b}"
         else:
             if piece == "16":
                 piece = "  "
@@ -120,15 +137,14 @@ class QuartoGame:
         self.showGameInformation()
 
     def getGameState(self):
-        return (
-            self.encodeBoard(),
-            self.availablePieces.copy(),
-            self.availablePositions.copy(),
-        )
+        return self.state.toState()
+
+    # the game state in the form the agent takes - older agents get the (encoding, pieces, positions) tuple
+    def getAgentState(self, agent: qagents.GenericQuartoAgent, gameState=None):
+        return qutil.agentGameState(agent, gameState if gameState is not None else self.getGameState())
 
     def makeFirstMove(self, nextPiece):
-        self.currentPiece = nextPiece
-        self.availablePieces.remove(self.currentPiece)
+        self.state.makeFirstMove(nextPiece)
         self.moveHistory.append((None, nextPiece))
         if self.gui_mode:
             print("First move successful")
@@ -140,30 +156,24 @@ class QuartoGame:
         if nextPiece not in range(16):
             print("This piece does not exist\n")
             return False
-        if position not in self.availablePositions:
+        if self.state.occupied >> position & 1:
             print("This cell is unavailable\n")
             return False
-        if nextPiece not in self.availablePieces:
+        if not self.state.pieces >> nextPiece & 1:
             print("This piece has already been placed or will be placed now\n")
             return False
         return True
 
     def __makeMove(self, position, nextPiece):
         self.moveHistory.append((position, nextPiece))
-        row, col = qutil.get2dCoords(position)
-        self.board[row][col] = self.currentPiece
-        self.availablePositions.remove(position)
-
-        self.currentPiece = nextPiece
-        self.availablePieces.remove(self.currentPiece)
+        self.state.makeMove(position, nextPiece)
 
         if self.gui_mode:
             print("Move successful")
 
     def makeLastMove(self):
-        lastPosition = self.availablePositions.pop()
-        row, col = qutil.get2dCoords(lastPosition)
-        self.board[row][col] = self.currentPiece
+        lastPosition = self.state.availablePositions()[0]
+        self.state.makeMove(lastPosition, qutil.NULL_PIECE)
         self.moveHistory.append((lastPosition, None))
 
         if self.gui_mode:
@@ -177,21 +187,22 @@ class QuartoGame:
             self.agent2_cumulative_time += endTime - startTime
             self.numMoves2 += 1
 
-    def tryMakeMove(self, isPlayerOneTurn):
+    def tryMakeMove(self, isPlayerOneTurn, gameState=None):
+        # the state is immutable, so every retry is given the same object
+        player = self.player1 if isPlayerOneTurn else self.player2
+        agentState = self.getAgentState(player, gameState)
         for i in range(self.numRetriesAllowed):
             position, nextPiece = None, None
 
             startTime = time.time()
-            if isPlayerOneTurn:
-                position, nextPiece = self.player1.makeMove(self.getGameState(), self.gui_mode)
-            else:
-                position, nextPiece = self.player2.makeMove(self.getGameState(), self.gui_mode)
+            position, nextPiece = player.makeMove(agentState, self.gui_mode)
             endTime = time.time()
 
             if self.isValidMove(position, nextPiece):
                 self.__makeMove(position, nextPiece)
                 if self.log_stats:
                     self.__logMoveTime(isPlayerOneTurn, startTime, endTime)
+                if self.detailedLogFile is not None:
                     self.detailedLogFile.write(
                         f"{position},{nextPiece},{round(endTime - startTime,4)}\n"
                     )
@@ -204,14 +215,14 @@ class QuartoGame:
         identifier = 1 if isPlayerOneTurn else 2
         playerName = self.player1Name if isPlayerOneTurn else self.player2Name
 
-        if qutil.isGameOver(self.board):
-            if self.log_stats:
+        if self.state.isGameOver():
+            if self.detailedLogFile is not None:
                 self.detailedLogFile.write(f"{identifier}\n")
             print(f"\nPlayer {identifier} ({playerName}) won!")
             return True
 
     def pickRandomAvailablePiece(self):
-        return int(np.random.choice(list(self.availablePieces)))
+        return int(np.random.choice(self.state.availablePieces()))
 
     def play(self, randomizeFirstMove=True):
         isPlayerOneTurn = True
@@ -222,14 +233,14 @@ class QuartoGame:
         if randomizeFirstMove:
             self.makeFirstMove(self.pickRandomAvailablePiece())
         else:
-            first_move = self.player1.makeFirstMove(self.getGameState(), self.gui_mode)
+            first_move = self.player1.makeFirstMove(self.getAgentState(self.player1), self.gui_mode)
             self.makeFirstMove(first_move)
         isPlayerOneTurn = False
         if self.gui_mode:
             self.showGameState()
 
         # subsequent moves
-        for _ in range(len(self.availablePositions) - 1):
+        for _ in range(self.state.numEmpty() - 1):
             if self.gui_mode:
                 self.__showPlayerName(isPlayerOneTurn)
             if not self.tryMakeMove(isPlayerOneTurn):
@@ -265,7 +276,7 @@ class QuartoGame:
         if randomizeFirstMove:
             self.makeFirstMove(self.pickRandomAvailablePiece())
         else:
-            first_move = self.player1.makeFirstMove(self.getGameState(), self.gui_mode)
+            first_move = self.player1.makeFirstMove(self.getAgentState(self.player1), self.gui_mode)
             self.makeFirstMove(first_move)
         isPlayerOneTurn = False
         self.detailedLogFile.write(str(self.moveHistory[-1]) + "\n")
@@ -273,12 +284,14 @@ class QuartoGame:
             self.showGameState()
 
         # subsequent moves
-        for _ in range(len(self.availablePositions) - 1):
+        for _ in range(self.state.numEmpty() - 1):
             if self.gui_mode:
                 self.__showPlayerName(isPlayerOneTurn)
-            self.detailedLogFile.write(self.encodeBoard() + ",")
+            # one encoding per move - the logged state is passed on to the agent
+            gameState = self.getGameState()
+            self.detailedLogFile.write(gameState.toEncoding() + ",")
 
-            if not self.tryMakeMove(isPlayerOneTurn):
+            if not self.tryMakeMove(isPlayerOneTurn, gameState):
                 if isPlayerOneTurn:
                     self.detailedLogFile.write("-1\n")
                     return -1
@@ -298,7 +311,7 @@ class QuartoGame:
         if self.gui_mode:
             self.__showPlayerName(isPlayerOneTurn)
         self.detailedLogFile.write(
-            f"{self.encodeBoard()},{list(self.availablePositions)[0]},None,None\n"
+            f"{self.encodeBoard()},{self.state.availablePositions()[0]},None,None\n"
         )
         self.makeLastMove()
 
@@ -352,3 +365,4 @@ class QuartoGame:
 
         logFile.close()
         self.detailedLogFile.close()
+        self.detailedLogFile = None
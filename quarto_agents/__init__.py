@@ -2,4 +2,5 @@ from .generic_quarto_agent import *
 from .human_player import *
 from .random_agent import *
 from .negamax_agent import *
-from .genetic_agent import *
\ No newline at end of file
+from .genetic_agent import *
+from .mcts_agent import *
\ No newline at end of file
@@ -1,7 +1,12 @@
 from abc import ABC, abstractmethod
 from typing import Any
+import multiprocessing as mp
 
 class GenericQuartoAgent(ABC):
+    # Agents that set this are given a quarto_util.GameState, otherwise they get the
+    # (encoding, available pieces, available positions) tuple - see quarto_util.agentGameState
+    usesGameState = False
+
     @abstractmethod
     def makeFirstMove(self, quartoGameState, gui_mode) -> int:
         pass
@@ -11,4 +16,36 @@ class GenericQuartoAgent(ABC):
         pass
 
     def setName(self, name) -> None:
-        self.name = name
\ No newline at end of file
+        self.name = name
+
+
+# Agents that search on a persistent process pool - the pool is started on first use, lives between moves and is not
+# pickled with the agent, so every process starts its own when it needs one
+class ProcessPoolAgent(GenericQuartoAgent):
+    pool = None
+
+    # (number of processes, initializer, initargs) of the pool
+    @abstractmethod
+    def poolConfig(self):
+        pass
+
+    # pool workers are daemonic and cannot start a pool of their own, so agents running inside one search in-process
+    @staticmethod
+    def canStartPool():
+        return not mp.current_process().daemon
+
+    def startPool(self):
+        if self.pool is None:
+            processes, initializer, initargs = self.poolConfig()
+            self.pool = mp.Pool(processes, initializer=initializer, initargs=initargs)
+
+    def closePool(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["pool"] = None
+        return state
\ No newline at end of file
@@ -1,13 +1,17 @@
-from quarto_agents.generic_quarto_agent import GenericQuartoAgent
+from quarto_agents.generic_quarto_agent import ProcessPoolAgent
 import quarto_util as qutil
+import quarto_endgame as qendgame
+import quarto_book as qbook
 import numpy as np
-from bigtree.node.node import Node
-from copy import copy
-from random import sample
+import itertools
+import time
+from array import array
 from math import factorial
 
 
-class GeneticMinmaxAgent(GenericQuartoAgent):
+class GeneticMinmaxAgent(ProcessPoolAgent):
+    usesGameState = True
+
     def __init__(
         self,
         searchDepth=3,
@@ -16,6 +20,17 @@ class GeneticMinmaxAgent(GenericQuartoAgent):
         mutationRate=0.8,
         initialPopulationSize=3,
         maxPopulationSize=10,
+        tablebase=None,
+        book=None,
+        keepTree=True,
+        islands=None,
+        migrationInterval=1,
+        migrationSize=10,
+        evalCacheSize=None,
+        keepEvalCache=False,
+        timeLimit=None,
+        evalBudget=None,
+        stableGenerations=None,
     ) -> None:
         super().__init__()
         super().setName(f"Genetic-{searchDepth}-{maxGenerations}-{initialPopulationSize}")
@@ -29,6 +44,43 @@ class GeneticMinmaxAgent(GenericQuartoAgent):
         self.maxPopulationSize = maxPopulationSize
         self.fitness = dict()
         self.fitnessCountLimit = maxPopulationSize
+        # breeding counters - children produced, repaired into valid move paths and discarded as duplicates
+        self.produced = 0
+        self.repaired = 0
+        self.discarded = 0
+        # endgame tablebase tables/<name>.qeb - exact results for the root and leaves with few empty cells
+        self.tablebase = None if tablebase is None else qendgame.EndgameTablebase.load(tablebase)
+        # opening book tables/<name>.qob - saves the population from spreading over equivalent opening moves
+        self.book = None if book is None else qbook.OpeningBook.load(book)
+        # the tree of the previous move is re-rooted after the opponent's reply and seeds the next population
+        self.keepTree = keepTree
+        self.reservationTree = None
+        self.previousState = None
+        self.previousMove = None
+        # island model - the population is split over this many islands evolving on a persistent process pool, which
+        # exchange their migrationSize fittest chromosomes every migrationInterval generations
+        self.islands = islands
+        self.migrationInterval = migrationInterval
+        self.migrationSize = migrationSize
+        self.pool = None
+        # leaf scores of evaluate, keyed by leaf position and side to move - shared by all generations of a move and,
+        # with keepEvalCache, by all later moves (None disables it). Only leaves covered by the tablebase go through
+        # evaluate, since evaluateBatch scores every other leaf in the replay that finds the wins, so the cache only saves
+        # tablebase probes and is off by default
+        self.evalCache = None if evalCacheSize is None else qutil.LRUCache(evalCacheSize)
+        self.keepEvalCache = keepEvalCache
+        self.cacheRoot = None
+        # anytime mode - with a time limit (seconds per move) or an evaluation budget (leaf evaluations per move) the
+        # generations run until the budget is spent instead of maxGenerations times
+        self.timeLimit = timeLimit
+        self.evalBudget = evalBudget
+        self.deadline = None
+        self.numEvaluations = 0
+        self.generations = 0
+        # evolution stops once the root minimax decision has not changed for this many generations
+        self.stableGenerations = stableGenerations
+        self.rootDecision = None
+        self.stableCount = 0
 
     # Only used in debugging
     def makeFirstMove(self, quartoGameState, gui_mode=False):
@@ -51,164 +103,148 @@ class GeneticMinmaxAgent(GenericQuartoAgent):
         )
 
     # Counts how many lines of three pieces with an identical property
-    def lineEvaluation(self, encoding, turn: bool):
-        board = [int(encoding[i] + encoding[i + 1]) for i in range(0, len(encoding) - 2, 2)]
-        tempLine = None
-        numLines = 0
-
-        for i in range(4):
-            # check horizontal lines
-            tempLine = board[4 * i : 4 * (i + 1)]
-            if tempLine.count(16) == 1:
-                tempLine.remove(16)
-                if qutil.matchingPropertyExists(tempLine):
-                    numLines += 1
-
-            tempLine = board[i : len(board) : 4]
-            # check vertical lines
-            if tempLine.count(16) == 1:
-                tempLine.remove(16)
-                if qutil.matchingPropertyExists(tempLine):
-                    numLines += 1
-
-        # check obtuse diagonal line
-        tempLine = board[0 : len(board) : 5]
-        if tempLine.count(16) == 1:
-            tempLine.remove(16)
-            if qutil.matchingPropertyExists(tempLine):
-                numLines += 1
-
-        # check acute diagonal line:
-        tempLine = board[3:-1:3]
-        if tempLine.count(16) == 1:
-            tempLine.remove(16)
-            if qutil.matchingPropertyExists(tempLine):
-                numLines += 1
+    def lineEvaluation(self, state: qutil.Bitboard, turn: bool):
+        numLines = state.countThreeLines()
 
         if turn:
             return -numLines
         else:
             return numLines
 
-    # Each move consists of 4 consecutive characters in the chromosome - 2 for place and 2 for next piece
-    # movePath is defined as a list of tuples which represent moves
-    def encodeChromosome(self, movePath):
-        encoding = "".join(
-            [
-                qutil.convertIntMoveToStr(move[0]) + qutil.convertIntMoveToStr(move[1])
-                for move in movePath
-            ]
-        )
-        return encoding
-
-    def decodeChromosome(self, chromosome):
-        movePath = [
-            (
-                int(chromosome[i] + chromosome[i + 1]),
-                int(chromosome[i + 2] + chromosome[i + 3]),
-            )
-            for i in range(0, len(chromosome) - 3, 4)
-        ]
-        return movePath
-
-    def createChromosome(self, quartoGameState):
-        _, availableNextPieces, availablePositions = quartoGameState
-        tempNextPieces = availableNextPieces.copy()
-        tempPositions = availablePositions.copy()
-        chromosomeLength = self.searchDepth
-
-        # generate random moves
-        if len(tempNextPieces) < self.searchDepth:
-            randomPieces = sample(tempNextPieces, len(tempNextPieces))
-            randomPieces.append(16)
-            randomPositions = sample(tempPositions, len(tempPositions))
-            chromosomeLength = len(tempPositions)
-        else:
-            randomPieces = sample(tempNextPieces, self.searchDepth)
-            randomPositions = sample(tempPositions, self.searchDepth)
-
-        newChromosome = ""
-        for i in range(chromosomeLength):
-            newChromosome += qutil.convertIntMoveToStr(randomPositions[i])
-            newChromosome += qutil.convertIntMoveToStr(randomPieces[i])
-
-        return newChromosome, self.evaluate(newChromosome, quartoGameState)
-
-    # one-point crossover
-    def crossover(self, chromosomeA, chromosomeB):
-        if len(chromosomeA) <= len(chromosomeB):
-            numMoves = len(chromosomeA) // 4
+    """
+    Chromosomes are move paths held as a population matrix of shape (population, moves, 2) - every row is one chromosome
+    and every move is a (position, next piece) pair. All genetic operators work on the whole matrix at once.
+    """
+
+    # Random move paths - each row takes the first moves of random permutations of the available positions and pieces.
+    # Given prefixes (one per row), every row starts with its prefix and is completed with random unused moves.
+    def createPopulation(self, state: qutil.Bitboard, size, prefixes=None):
+        availablePositions = np.array(state.availablePositions(), dtype=np.int8)
+        availablePieces = np.array(state.availablePieces(), dtype=np.int8)
+        positionKeys = np.random.random((size, len(availablePositions)))
+        pieceKeys = np.random.random((size, len(availablePieces)))
+
+        if len(availablePieces) < self.searchDepth:
+            # the rest of the game is shorter than the search depth - the last move has no next piece
+            numMoves = len(availablePositions)
+            availablePieces = np.append(availablePieces, np.int8(16))
+            pieceKeys = np.hstack([pieceKeys, np.full((size, 1), 1.5)])
         else:
-            numMoves = len(chromosomeB) // 4
-
-        if numMoves == 1:
-            return chromosomeA
-
-        point = np.random.randint(1, numMoves)
-        return chromosomeA[: 4 * point] + chromosomeB[4 * point :]
-
-    def mutation(self, chromosome, quartoGameState):
-        numMoves = len(chromosome) // 2
-        positions = list(range(0, numMoves, 2))
-        pieces = list(range(1, numMoves, 2))
-
-        if np.random.sample() < 0.8:
-            mutationPoint = np.random.choice(positions)
-        else:
-            mutationPoint = np.random.choice(pieces)
-
-        if mutationPoint % 2 == 0:  # move position
-            mutation = sample(quartoGameState[2], 1)[0]
-        else:  # move nextPiece
-            mutation = sample(quartoGameState[1], 1)[0]
-
-        move = qutil.convertIntMoveToStr(mutation)
-        mutatedChromosome = (
-            chromosome[: 2 * mutationPoint] + move + chromosome[2 * mutationPoint + 2 :]
+            numMoves = self.searchDepth
+
+        numPrefixMoves = 0
+        if prefixes is not None:
+            # genes already used by a row's prefix sort behind all the others
+            numPrefixMoves = prefixes.shape[1]
+            positionKeys[(prefixes[:, :, 0, None] == availablePositions).any(axis=1)] += 2
+            pieceKeys[(prefixes[:, :, 1, None] == availablePieces).any(axis=1)] += 2
+
+        positions = availablePositions[np.argsort(positionKeys, axis=1)]
+        pieces = availablePieces[np.argsort(pieceKeys, axis=1)]
+        population = np.stack(
+            [positions[:, : numMoves - numPrefixMoves], pieces[:, : numMoves - numPrefixMoves]], axis=2
         )
+        return population if prefixes is None else np.concatenate([prefixes, population], axis=1)
 
-        return mutatedChromosome
-
-    def isValidChromosome(self, chromosome, quartoGameState):
-        # check if chromosome is valid
-        positions = [int(chromosome[i : i + 2]) for i in range(0, len(chromosome), 4)] + list(
-            set(range(16)) - quartoGameState[2]
+    # one-point crossover of every row of parentsA with the same row of parentsB
+    def crossover(self, parentsA, parentsB):
+        numMoves = parentsA.shape[1]
+        if numMoves == 1:
+            return parentsA.copy()
+
+        points = np.random.randint(1, numMoves, size=len(parentsA))
+        fromB = np.arange(numMoves)[None, :] >= points[:, None]
+        return np.where(fromB[:, :, None], parentsB, parentsA)
+
+    # every row gets one random gene replaced - a position with probability 0.8, otherwise a next piece
+    def mutation(self, parents, state: qutil.Bitboard):
+        children = parents.copy()
+        rows = np.arange(len(children))
+        moves = np.random.randint(children.shape[1], size=len(children))
+        genes = (np.random.random(len(children)) >= 0.8).astype(np.int8)
+
+        availablePositions = np.array(state.availablePositions(), dtype=np.int8)
+        availablePieces = np.array(state.availablePieces() or (16,), dtype=np.int8)
+        children[rows, moves, genes] = np.where(
+            genes == 0,
+            availablePositions[np.random.randint(len(availablePositions), size=len(children))],
+            availablePieces[np.random.randint(len(availablePieces), size=len(children))],
         )
-        nextPieces = [int(chromosome[i : i + 2]) for i in range(2, len(chromosome), 4)] + list(
-            set(range(16)) - quartoGameState[1]
+        return children
+
+    # Fixes the genes of every row in place - a gene that is not available or repeats an earlier gene of its row is
+    # replaced by the lowest available gene the row does not use yet. Returns the mask of the rows that were changed.
+    def repairGenes(self, genes, available):
+        numGenes = genes.shape[1]
+        matches = genes[:, :, None] == available
+        repeats = (genes[:, :, None] == genes[:, None, :]) & np.tri(numGenes, k=-1, dtype=bool)
+        broken = ~matches.any(axis=2) | repeats.any(axis=2)
+
+        # the genes each row keeps sort behind the unused ones, which stay in ascending order
+        used = (matches & ~broken[:, :, None]).any(axis=1)
+        order = np.argsort(np.where(used, len(available), 0) + np.arange(len(available)), axis=1)
+        rows, columns = np.nonzero(broken)
+        ranks = np.cumsum(broken, axis=1) - 1
+        genes[rows, columns] = available[order[rows, ranks[rows, columns]]]
+        return broken.any(axis=1)
+
+    # makes every row a valid move path from the state - returns the mask of the rows that were changed
+    def repair(self, population, state: qutil.Bitboard):
+        availablePositions = np.array(sorted(state.availablePositions()), dtype=np.int8)
+        availablePieces = np.array(sorted(state.availablePieces()), dtype=np.int8)
+        repaired = self.repairGenes(population[:, :, 0], availablePositions)
+        if len(availablePieces) < population.shape[1]:
+            # the path plays out the rest of the game - the last move has no next piece
+            repaired |= population[:, -1, 1] != 16
+            population[:, -1, 1] = 16
+            repaired |= self.repairGenes(population[:, :-1, 1], availablePieces)
+        else:
+            repaired |= self.repairGenes(population[:, :, 1], availablePieces)
+        return repaired
+
+    # drops repeated rows, keeping the first occurrence of each chromosome in order
+    def uniqueChromosomes(self, population):
+        if len(population) == 0:
+            return population
+        _, first = np.unique(population.reshape(len(population), -1), axis=0, return_index=True)
+        return population[np.sort(first)]
+
+    # Produces one generation of children in a single pass - numAttempts random parent pairs are drawn and each pair is
+    # either mutated (first parent), crossed over or left alone. Children that repeat or use unavailable genes are
+    # repaired, so only children already in the population or the generation are discarded.
+    def breed(self, parents, numAttempts, state: qutil.Bitboard):
+        a = np.random.randint(len(parents), size=numAttempts)
+        b = (a + np.random.randint(1, len(parents), size=numAttempts)) % len(parents)
+        mutate = np.random.random(numAttempts) < self.mutationRate
+        cross = ~mutate & (np.random.random(numAttempts) < self.crossoverRate)
+
+        children = np.where(
+            mutate[:, None, None], self.mutation(parents[a], state), self.crossover(parents[a], parents[b])
         )
-        if len(set(positions)) < len(positions):
-            return False
-        if len(set(nextPieces)) < len(nextPieces):
-            return False
-
-        return True
+        children = children[mutate | cross]
+        numProduced = len(children)
+        self.produced += numProduced
+        self.repaired += int(np.count_nonzero(self.repair(children, state)))
+
+        # children identical to a parent are already in the reservation tree
+        known = {row.tobytes() for row in parents}
+        children = self.uniqueChromosomes(children)
+        children = children[[row.tobytes() not in known for row in children]]
+        self.discarded += numProduced - len(children)
+        return children
 
     # evaluate chromosome leaf node
-    def evaluate(self, chromosome, quartoGameState):
-        movePath = [
-            (
-                int(chromosome[i] + chromosome[i + 1]),
-                int(chromosome[i + 2] + chromosome[i + 3]),
-            )
-            for i in range(0, len(chromosome) - 3, 4)
-        ]
-
-        boardEncoding = quartoGameState[0]
-        tempCurrentPiece = int(boardEncoding[-2:])
+    def evaluate(self, chromosome, rootState: qutil.Bitboard):
+        state = rootState.copy()
         evaluation = 0
         myTurn = True
         isGameOver = False
 
-        # update board encoding and temporary piece
-        for move in movePath:
-            tempCurrentPiece = qutil.convertIntMoveToStr(tempCurrentPiece)
-            boardEncoding = (
-                boardEncoding[: 2 * move[0]] + tempCurrentPiece + boardEncoding[2 * move[0] + 2 :]
-            )
-            tempCurrentPiece = move[1]
+        # play the move path on a copy of the root bitboard
+        for position, nextPiece in chromosome.tolist():
+            state.makeMove(position, nextPiece)
 
-            if qutil.isGameOverEncoding(boardEncoding):
+            if state.isWinAt(position):
                 isGameOver = True
                 if myTurn:
                     evaluation = 10
@@ -218,34 +254,288 @@ class GeneticMinmaxAgent(GenericQuartoAgent):
 
             myTurn = not myTurn
 
-        # case when no player has won
-        if not isGameOver:
-            evaluation = self.lineEvaluation(boardEncoding, not myTurn)
+        if isGameOver:
+            return evaluation
+
+        # case when no player has won - the score only depends on the leaf position and the side to move
+        cacheKey = (state.key, myTurn)
+        if self.evalCache is not None:
+            cached = self.evalCache.get(cacheKey)
+            if cached is not None:
+                return cached
+
+        # the tablebase value is for the player to move at the leaf
+        entry = None
+        if self.tablebase is not None and self.tablebase.covers(state):
+            entry = self.tablebase.probe(state)
+        if entry is not None:
+            evaluation = 10 * entry[0] if myTurn else -10 * entry[0]
+        else:
+            evaluation = self.lineEvaluation(state, not myTurn)
 
+        if self.evalCache is not None:
+            self.evalCache.put(cacheKey, evaluation)
         return evaluation
 
-    # recursive function to update the fitness of the top N chromosomes
+    # Evaluates a whole population with the same result as evaluate - all move paths are played from the root in lock
+    # step by qutil.simulatePaths, which reports the first ply each path wins at and the line heuristic of its leaf
+    def evaluateBatch(self, population, rootState: qutil.Bitboard):
+        numMoves = population.shape[1]
+        positions = population[:, :, 0]
+        # the piece placed by each move is the current piece, then the next piece chosen by the previous move
+        placedPieces = np.empty_like(positions)
+        placedPieces[:, 0] = rootState.currentPiece
+        placedPieces[:, 1:] = population[:, :-1, 1]
+        winPly, threeLines = qutil.simulatePaths(rootState, positions, placedPieces)
+
+        # moves alternate between us (even plies) and the opponent
+        evaluations = np.where(winPly % 2 == 0, 10, -10)
+        # case when no player has won - the leaf is scored for the player to move after numMoves moves
+        leaves = winPly == -1
+        evaluations[leaves] = threeLines[leaves] if numMoves % 2 == 0 else -threeLines[leaves]
+        if self.tablebase is not None and self.tablebase.coversNumEmpty(rootState.numEmpty() - numMoves):
+            for k in np.flatnonzero(leaves):
+                evaluations[k] = self.evaluate(population[k], rootState)
+
+        return evaluations.tolist()
+
+    def addToTree(self, population, rootState: qutil.Bitboard):
+        self.numEvaluations += len(population)
+        for path, leafEvaluation in zip(population.tolist(), self.evaluateBatch(population, rootState)):
+            self.reservationTree.addPath(path, leafEvaluation)
+
+    # recursive function to update the fitness of the top N chromosomes - fitness is keyed by leaf node id
     def computeFitness(self, node, evaluation, i):
         if self.fitnessCounter >= self.fitnessCountLimit:
             return
-        if node.is_leaf:
-            self.fitness[node.name] = evaluation
+        tree = self.reservationTree
+        if tree.isLeaf(node):
+            self.fitness[node] = evaluation
             self.fitnessCounter += 1
         else:
-            for child in [n for n in node.children if n.value == evaluation]:
+            for child in [n for n in tree.children(node) if tree.value[n] == evaluation]:
                 self.computeFitness(child, evaluation, i)
 
+    # update fitness for all chromosomes in the reservation tree
+    def selectFitness(self):
+        self.fitnessCounter = 0
+        self.fitness.clear()
+        leafEvaluations = sorted(self.reservationTree.uniqueValues)[::-1]
+        for i in range(len(leafEvaluations)):
+            self.computeFitness(self.reservationTree.rootNode, leafEvaluations[i], i)
+
+    def bestChromosome(self):
+        return max(self.fitness, key=lambda chromosome: self.fitness[chromosome])
+
+    def budgeted(self):
+        return self.deadline is not None or self.evalBudget is not None
+
+    def budgetSpent(self):
+        return (self.deadline is not None and time.perf_counter() > self.deadline) or (
+            self.evalBudget is not None and self.numEvaluations >= self.evalBudget
+        )
+
+    # follows the root minimax decision after a selection - True once it has been stable for stableGenerations
+    def isStable(self, numGenerations=1):
+        decision = self.reservationTree.firstMove(self.bestChromosome())
+        if decision == self.rootDecision:
+            self.stableCount += numGenerations
+        else:
+            self.rootDecision, self.stableCount = decision, 0
+        return self.stableGenerations is not None and self.stableCount >= self.stableGenerations
+
+    # Runs generations on the reservation tree and returns the top N chromosomes of the last one. Without a number of
+    # generations it runs until the budget is spent or a generation adds nothing new to the tree. The first generation
+    # always runs, so there is a best chromosome however small the budget.
+    def evolve(self, state: qutil.Bitboard, population, numGenerations, initialPopulationSize, maxPopulationSize):
+        for generation in itertools.count() if numGenerations is None else range(numGenerations):
+            if generation > 0 and self.budgetSpent():
+                break
+            numNodes = len(self.reservationTree)
+
+            # perform crossover and mutation - repair keeps paths that play out the rest of the game valid
+            numAttempts = maxPopulationSize - max(len(population), initialPopulationSize)
+            if self.budgeted():
+                # the budget replaces the generation count, so every generation breeds a full set of children
+                numAttempts = max(numAttempts, maxPopulationSize - initialPopulationSize)
+                if self.evalBudget is not None:
+                    numAttempts = min(numAttempts, self.evalBudget - self.numEvaluations)
+            if numAttempts > 0 and len(population) >= 2:
+                self.addToTree(self.breed(population, numAttempts, state), state)
+
+            # set next generation's initial population as the top N chromosomes of this generation
+            self.selectFitness()
+            population = self.reservationTree.paths(list(self.fitness))
+            self.generations += 1
+            if self.isStable() or (numGenerations is None and len(self.reservationTree) == numNodes):
+                break
+        return population
+
+    """
+    Island model - the initial population is dealt out to the islands, which evolve on the worker pool and pass their
+    fittest chromosomes on to the next island in a ring every migrationInterval generations. Islands are not tied to a
+    worker, so every job carries the paths and values of its island's leaves and the worker rebuilds the island's tree
+    from them. Finally the leaves of all islands are merged into one reservation tree and fitness is selected over it,
+    so the move is the minimax decision over everything the islands explored.
+    """
+    def islandEvolution(self, state: qutil.Bitboard, population, initialPopulationSize, maxPopulationSize):
+        self.startPool()
+        numIslands = self.islands
+        encoding = state.toEncoding()
+        islandInitialSize = max(initialPopulationSize // numIslands, 1)
+        islandMaxSize = max(maxPopulationSize // numIslands, 1)
+        populations = [population[i::numIslands] for i in range(numIslands)]
+        leafPaths = [None] * numIslands
+        leafValues = [[] for _ in range(numIslands)]
+        immigrants = [None] * numIslands
+
+        generation = 0
+        while self.budgeted() or generation < self.maxGenerations:
+            if self.budgeted():
+                numGenerations = self.migrationInterval
+            else:
+                numGenerations = min(self.migrationInterval, self.maxGenerations - generation)
+            evalShare = None
+            if self.evalBudget is not None:
+                evalShare = max((self.evalBudget - self.numEvaluations) // numIslands, 0)
+            seeds = np.random.randint(2**31 - 1, size=numIslands).tolist()
+            jobs = [
+                (
+                    encoding,
+                    leafPaths[i],
+                    leafValues[i],
+                    populations[i],
+                    immigrants[i],
+                    numGenerations,
+                    islandInitialSize,
+                    islandMaxSize,
+                    self.deadline,
+                    evalShare,
+                    seeds[i],
+                )
+                for i in range(numIslands)
+            ]
+            results = self.pool.map(_evolveIsland, jobs, chunksize=1)
+            for i, (paths, values, population, counts) in enumerate(results):
+                self.produced += counts[0]
+                self.repaired += counts[1]
+                self.discarded += counts[2]
+                if self.evalCache is not None:
+                    self.evalCache.hits += counts[3]
+                    self.evalCache.misses += counts[4]
+                self.numEvaluations += counts[5]
+                if values:
+                    leafPaths[i] = paths if leafPaths[i] is None else np.concatenate([leafPaths[i], paths])
+                    leafValues[i] += values
+                populations[i] = population
+            if numIslands > 1:
+                immigrants = [populations[i - 1][: self.migrationSize] for i in range(numIslands)]
+            generation += numGenerations
+            self.generations += numGenerations
+
+            # the merged tree is rebuilt after every migration to follow the root decision
+            numNodes = len(self.reservationTree)
+            self.reservationTree = ReservationTree.fromPaths(
+                np.concatenate([paths for paths in leafPaths if paths is not None]), sum(leafValues, [])
+            )
+            self.selectFitness()
+            if self.isStable(numGenerations) or self.budgetSpent():
+                break
+            if self.budgeted() and len(self.reservationTree) == numNodes:
+                break
+
+    # every worker holds its own copy of this agent
+    def poolConfig(self):
+        return self.islands, _initIslandWorker, (self,)
+
+    # Cached scores never go stale, since they only depend on the leaf position and the side to move relative to the
+    # player at the root. Without keepEvalCache the cache is still emptied for every new root to keep it small.
+    def prepareEvalCache(self, state: qutil.Bitboard):
+        if self.evalCache is not None and not self.keepEvalCache and state.key != self.cacheRoot:
+            self.evalCache.clear()
+        self.cacheRoot = state.key
+
+    # (produced, repaired, discarded, cache hits, cache misses, evaluations) - breeding, eval cache and search counters
+    def counters(self):
+        cache = self.evalCache
+        return (
+            self.produced,
+            self.repaired,
+            self.discarded,
+            0 if cache is None else cache.hits,
+            0 if cache is None else cache.misses,
+            self.numEvaluations,
+        )
+
+    def displayEvalCacheMetrics(self):
+        if self.evalCache is None:
+            print("No eval cache is used. Cannot display any eval cache metrics.")
+        else:
+            cache = self.evalCache
+            print(f"\neval cache hits: {cache.hits}, misses: {cache.misses}, entries: {len(cache)} / {cache.capacity}")
+            print(f"hit rate: {round(cache.hitRate()*100,2)} %\n")
+
+    def displayBreedingMetrics(self):
+        print(f"\nchildren produced: {self.produced}, repaired: {self.repaired}, discarded: {self.discarded}")
+        if self.produced != 0:
+            print(
+                f"repair rate: {round((self.repaired/self.produced)*100,2)} %, "
+                f"discard rate: {round((self.discarded/self.produced)*100,2)} %\n"
+            )
+
+    # Re-roots the tree of our previous move onto the position reached after that move and the opponent's reply.
+    # Returns the suffixes of the chromosomes below it, or None if the position does not follow from the previous one.
+    def rerootTree(self, state: qutil.Bitboard):
+        tree, previousState = self.reservationTree, self.previousState
+        if tree is None or previousState is None:
+            return None
+        reply = qutil.opponentReply(previousState, self.previousMove, state)
+        if reply is None:
+            return None
+
+        position, nextPiece = self.previousMove
+        child = tree.childIndex.get(position << 5 | nextPiece)
+        if child is None:
+            return None
+        opponentPosition, opponentPiece = reply
+        grandchild = tree.childIndex.get(child << 9 | opponentPosition << 5 | opponentPiece)
+        if grandchild is None or tree.isLeaf(grandchild):
+            return None
+
+        self.reservationTree, suffixes = tree.subtree(grandchild, tree.leaves(grandchild)[: self.initialPopulationSize])
+        return suffixes
+
     # main Genetic Minimax implementation
     def generateSolution(self, quartoGameState):
-        # initialize reservation tree
-        self.reservationTree = ReservationTree()
+        self.deadline = None if self.timeLimit is None else time.perf_counter() + self.timeLimit
+        self.numEvaluations = 0
+        self.generations = 0
+        self.rootDecision, self.stableCount = None, 0
+        state = quartoGameState.toBitboard()
+        # initialize reservation tree - or carry over the part of the previous one the game went into
+        seeds = self.rerootTree(state) if self.keepTree else None
+        if seeds is None:
+            self.reservationTree = ReservationTree()
+        self.previousState = None
+        self.prepareEvalCache(state)
+
+        # the tablebase already knows the best move of small endgames
+        if self.tablebase is not None and self.tablebase.covers(state):
+            entry = self.tablebase.probe(state)
+            if entry is not None:
+                value, position, nextPiece = entry
+                return (position, nextPiece), 10 * value
+        entry = None if self.book is None else self.book.probe(state)
+        if entry is not None:
+            score, _, position, nextPiece = entry
+            return (position, nextPiece), score
 
         # reduce initial population size to maximum possible moves explorable
         initialPopulationSize = self.initialPopulationSize
         maxPopulationSize = self.maxPopulationSize
         self.fitnessCountLimit = self.maxPopulationSize
 
-        numPossibleMoves = len(quartoGameState[2])
+        numPossibleMoves = state.numEmpty()
         if numPossibleMoves > self.searchDepth:
             maxPossibleStates = self.getNumStates(numPossibleMoves)
             if maxPossibleStates < initialPopulationSize:
@@ -253,148 +543,289 @@ class GeneticMinmaxAgent(GenericQuartoAgent):
                 maxPopulationSize = int(2 * maxPossibleStates)
                 self.fitnessCountLimit = maxPopulationSize
 
-        # randomize initial population
-        self.fitness.clear()
-        for _ in range(initialPopulationSize):
-            chromosome, leafEvaluation = self.createChromosome(quartoGameState)
-            self.fitness[chromosome] = 0
-            self.reservationTree.addPath(chromosome, leafEvaluation)
-
-        bestChromosome = ""
-        finalEvaluation = -1
-        for _ in range(self.maxGenerations):
-            # perform crossover and mutation
-            parents = self.fitness.keys()
-
-            for _ in range(maxPopulationSize - np.max([len(parents), initialPopulationSize])):
-                # random parent selection
-                if len(parents) < 2:
-                    break
-                a, b = sample(parents, 2)
-
-                # random mutation
-                if np.random.sample() < self.mutationRate:
-                    mutatedChild = self.mutation(a, quartoGameState)
-
-                    if len(mutatedChild) < 4 * self.searchDepth:
-                        continue
-
-                    if self.isValidChromosome(mutatedChild, quartoGameState):
-                        self.fitness[mutatedChild] = 0
-                        leafEvaluation = self.evaluate(mutatedChild, quartoGameState)
-                        self.reservationTree.addPath(mutatedChild, leafEvaluation)
-
-                    continue
-
-                if a == b:
-                    continue
-
-                # crossover
-                if np.random.sample() < self.crossoverRate:
-                    crossoverChild = self.crossover(a, b)
-
-                    if len(crossoverChild) < 4 * self.searchDepth:
-                        continue
-
-                    if self.isValidChromosome(crossoverChild, quartoGameState):
-                        self.fitness[crossoverChild] = 0
-                        leafEvaluation = self.evaluate(crossoverChild, quartoGameState)
-                        self.reservationTree.addPath(crossoverChild, leafEvaluation)
-
-            # update fitness for all chromosomes in this generation
-            self.fitnessCounter = 0
-            self.fitness.clear()
-            leafEvaluations = sorted(self.reservationTree.uniqueValues)[::-1]
-            for i in range(len(leafEvaluations)):
-                self.computeFitness(self.reservationTree.rootNode, leafEvaluations[i], i)
+        # randomize initial population, completing the surviving chromosomes first - leaves are evaluated in one batch
+        if seeds is None:
+            population = self.createPopulation(state, initialPopulationSize)
+        else:
+            seeds = seeds[:initialPopulationSize]
+            population = np.concatenate(
+                [
+                    self.createPopulation(state, len(seeds), prefixes=seeds),
+                    self.createPopulation(state, initialPopulationSize - len(seeds)),
+                ]
+            )
+        population = self.uniqueChromosomes(population)
+        if self.evalBudget is not None:
+            population = population[: max(self.evalBudget, 1)]
 
-            # set next generation's initial population as the top N chromosomes of this generation
-            bestChromosome = max(self.fitness, key=lambda chromosome: self.fitness[chromosome])
-            finalEvaluation = self.fitness[bestChromosome]
+        if self.islands is not None and self.canStartPool():
+            self.islandEvolution(state, population, initialPopulationSize, maxPopulationSize)
+        else:
+            self.addToTree(population, state)
+            numGenerations = None if self.budgeted() else self.maxGenerations
+            self.evolve(state, population, numGenerations, initialPopulationSize, maxPopulationSize)
 
-        bestMove = (
-            int(bestChromosome[0] + bestChromosome[1]),
-            int(bestChromosome[2] + bestChromosome[3]),
-        )
-        return bestMove, finalEvaluation
+        bestChromosome = self.bestChromosome()
+        finalEvaluation = self.fitness[bestChromosome]
+        position, nextPiece = self.reservationTree.firstMove(bestChromosome)
+        self.previousState, self.previousMove = state, (position, nextPiece)
+        return (position, nextPiece), finalEvaluation
 
 
 class ReservationTree:
+    """
+    Trie of the move paths explored by the genetic search, kept in flat arrays indexed by integer node ids (the root is
+    node 0). A move is encoded as position << 5 | piece. Children are found in O(1) through a dictionary keyed by
+    parent << 9 | move and are also linked in insertion order for traversal.
+    Node values are the minimax values of the leaves below them - nodes at even depth are MAX nodes, the others MIN
+    nodes.
+    """
 
     def __init__(self) -> None:
-        self.rootNode = Node("root", value=-10)
-        self.leafNodes = dict()
+        self.parent = array("i", [-1])
+        self.move = array("h", [-1])
+        self.depth = array("b", [0])
+        self.value = array("b", [-10])
+        self.firstChild = array("i", [-1])
+        self.lastChild = array("i", [-1])
+        self.nextSibling = array("i", [-1])
+        self.childIndex = dict()
         self.uniqueValues = set()
+        self.rootNode = 0
+
+    def __len__(self):
+        return len(self.parent)
+
+    # Builds the tree of whole leaf paths (all of the same length) and their values in one pass - paths are sorted so
+    # every node is a run of paths sharing a prefix, nodes are numbered level by level and values are reduced bottom-up
+    @classmethod
+    def fromPaths(cls, paths, values):
+        tree = cls()
+        numPaths, numMoves = paths.shape[:2]
+        if numPaths == 0:
+            return tree
+        moves = paths[:, :, 0].astype(np.int64) << 5 | paths[:, :, 1]
+        order = np.lexsort(moves.T[::-1])
+        moves, values = moves[order], np.asarray(values)[order]
+
+        # a path starts a new node at every level from the first move it does not share with the previous path
+        newNode = np.ones((numPaths, numMoves), dtype=bool)
+        newNode[1:] = np.logical_or.accumulate(moves[1:] != moves[:-1], axis=1)
+
+        parents, levelMoves, depths, levelStarts = [[-1]], [[-1]], [[0]], []
+        pathNodes = np.zeros(numPaths, dtype=np.int64)
+        numNodes = 1
+        for k in range(numMoves):
+            starts = np.flatnonzero(newNode[:, k])
+            parents.append(pathNodes[starts])
+            levelMoves.append(moves[starts, k])
+            depths.append(np.full(len(starts), k + 1))
+            levelStarts.append(starts)
+            pathNodes = numNodes + np.cumsum(newNode[:, k]) - 1
+            numNodes += len(starts)
+        parent = np.concatenate(parents)
+        move = np.concatenate(levelMoves)
+        depth = np.concatenate(depths)
+
+        # minmax from the leaves up - the children of each level form runs by parent
+        levelValues = values[levelStarts[-1]]
+        nodeValues = [levelValues]
+        for k in range(numMoves - 1, -1, -1):
+            childParents = parents[k + 1]
+            runs = np.flatnonzero(np.r_[True, childParents[1:] != childParents[:-1]])
+            reduce = np.maximum if k % 2 == 0 else np.minimum
+            levelValues = reduce.reduceat(levelValues, runs)
+            nodeValues.append(levelValues)
+        value = np.concatenate(nodeValues[::-1])
+
+        ids = np.arange(numNodes)
+        firstChild = np.full(numNodes, -1)
+        lastChild = np.full(numNodes, -1)
+        firstChild[parent[:0:-1]] = ids[:0:-1]
+        lastChild[parent[1:]] = ids[1:]
+        nextSibling = np.full(numNodes, -1)
+        nextSibling[:-1] = np.where(parent[1:] == parent[:-1], ids[1:], -1)
+
+        tree.parent = array("i", parent.astype(np.int32).tobytes())
+        tree.move = array("h", move.astype(np.int16).tobytes())
+        tree.depth = array("b", depth.astype(np.int8).tobytes())
+        tree.value = array("b", value.astype(np.int8).tobytes())
+        tree.firstChild = array("i", firstChild.astype(np.int32).tobytes())
+        tree.lastChild = array("i", lastChild.astype(np.int32).tobytes())
+        tree.nextSibling = array("i", nextSibling.astype(np.int32).tobytes())
+        tree.childIndex = dict(zip((parent[1:] << 9 | move[1:]).tolist(), range(1, numNodes)))
+        tree.uniqueValues = set(values.tolist())
+        return tree
+
+    def isLeaf(self, node):
+        return self.firstChild[node] == -1
+
+    def children(self, node):
+        child = self.firstChild[node]
+        while child != -1:
+            yield child
+            child = self.nextSibling[child]
+
+    def showTree(self, node=0):
+        if node != 0:
+            move = self.move[node]
+            print("  " * (self.depth[node] - 1) + f"({move >> 5}, {move & 31}) value={self.value[node]}")
+        for child in self.children(node):
+            self.showTree(child)
+
+    def addNode(self, parent, move, value):
+        node = len(self.parent)
+        self.parent.append(parent)
+        self.move.append(move)
+        self.depth.append(self.depth[parent] + 1)
+        self.value.append(value)
+        self.firstChild.append(-1)
+        self.lastChild.append(-1)
+        self.nextSibling.append(-1)
+
+        if self.firstChild[parent] == -1:
+            self.firstChild[parent] = node
+        else:
+            self.nextSibling[self.lastChild[parent]] = node
+        self.lastChild[parent] = node
+        self.childIndex[parent << 9 | move] = node
+        return node
 
-    def showTree(self):
-        self.rootNode.show(attr_list=["value"])
-
-    # updates node values using minmax along a path from leaf to root
-    def minmax(self, leaf):
-        # determine if MIN or MAX
-        maxTurn = (len(leaf.name) / 4) % 2 == 0
-
-        # recurrently update node values
-        current = leaf
-        while current.parent != None:
-            current = current.parent
-            maxTurn = not maxTurn
-
-            if maxTurn:
-                current.value = np.max([i.value for i in current.children])
-            else:
-                current.value = np.min([i.value for i in current.children])
-
-    # Given a chromosome, finds the last node in the tree where it exists
-    def findChromosomeNode(self, encoding):
-        currentRoot = self.rootNode
-        lastIndex = 0
-
-        for i in range(4, len(encoding) + 1, 4):
-            stop = True
-
-            for node in currentRoot.children:
-                if node.name == encoding[:i]:
-                    currentRoot = node
-                    lastIndex = i
-                    stop = False
-                    break
-
-            if stop:
-                break
-
-        return currentRoot, lastIndex
-
-    # adds a new path of nodes from a chromosome encoding
-    def addPath(self, encoding, leafEvaluation):
-        current, lastIndex = self.findChromosomeNode(encoding)
-        movePath = [
-            (int(encoding[i] + encoding[i + 1]), int(encoding[i + 2] + encoding[i + 3]))
-            for i in range(lastIndex, len(encoding) - 3, 4)
-        ]
+    # adds a path of (position, piece) moves ending in a leaf with the given evaluation and returns the leaf
+    def addPath(self, path, leafEvaluation):
         self.uniqueValues.add(leafEvaluation)
-        for m in range(0, len(movePath)):
-            if m == len(movePath) - 1:  # leaf node
-                current = Node(
-                    encoding[0 : lastIndex + 4 * (m + 1)],
-                    value=leafEvaluation,
-                    parent=current,
-                )
-                self.minmax(current)
-                self.leafNodes[encoding] = current
-            else:
-                current = Node(encoding[0 : lastIndex + 4 * (m + 1)], value=-10, parent=current)
-
-    def computeFitness(self, encoding):
-        currNode = self.leafNodes[encoding]
-        leafValue = currNode.value  # type: ignore
-
-        while currNode is not None:
-            if currNode.parent.value == leafValue:  # type: ignore
-                currNode = currNode.parent
-                if currNode == self.rootNode:
-                    break
+        childIndex = self.childIndex
+        node = 0
+        for i in range(len(path)):
+            position, piece = path[i]
+            child = childIndex.get(node << 9 | position << 5 | piece)
+            if child is None:
+                # the rest of the path is new - each new node has a single child, so they all take the leaf value
+                top = node = self.addNode(node, position << 5 | piece, leafEvaluation)
+                for position, piece in path[i + 1 :]:
+                    node = self.addNode(node, position << 5 | piece, leafEvaluation)
+                self.minmax(top)
+                return node
+            node = child
+        return node
+
+    # Updates node values using minmax from a new or changed node towards the root. An ancestor only has to look at all
+    # of its children when the child that held its value got worse, and propagation stops at the first unchanged value.
+    def minmax(self, node, oldValue=None):
+        value, parent, depth = self.value, self.parent, self.depth
+        childValue = value[node]
+        while node != 0:
+            current = parent[node]
+            old = value[current]
+            maximize = depth[current] % 2 == 0
+            if self.firstChild[current] == self.lastChild[current]:
+                new = childValue
+            elif childValue > old if maximize else childValue < old:
+                new = childValue
+            elif oldValue == old:
+                childValues = [value[child] for child in self.children(current)]
+                new = max(childValues) if maximize else min(childValues)
             else:
                 break
 
-        return self.rootNode.max_depth - currNode.depth + 1  # type: ignore
+            if new == old:
+                break
+            value[current] = new
+            oldValue, childValue, node = old, new, current
+
+    # the first move of the path to node as (position, piece)
+    def firstMove(self, node):
+        while self.depth[node] > 1:
+            node = self.parent[node]
+        move = self.move[node]
+        return move >> 5, move & 31
+
+    # leaf ids below node in insertion order
+    def leaves(self, node=0):
+        leaves, stack = [], [node]
+        while stack:
+            node = stack.pop()
+            if self.isLeaf(node):
+                leaves.append(node)
+            else:
+                stack.extend(reversed(list(self.children(node))))
+        return leaves
+
+    # New tree rooted at node (at an even depth, so MAX and MIN nodes keep their roles) holding the paths from node to
+    # the given leaves. Returns it with the path suffixes - the old leaf values only stand in until the suffixes are
+    # extended to full chromosomes and evaluated again.
+    def subtree(self, node, leaves):
+        suffixes = self.paths(leaves)[:, self.depth[node] :]
+        tree = ReservationTree.fromPaths(suffixes, [self.value[leaf] for leaf in leaves])
+        tree.uniqueValues.clear()
+        return tree, suffixes
+
+    # moves of the paths from the root to the given nodes (all at the same depth) as a (nodes, depth, 2) array
+    def paths(self, nodes):
+        nodes = np.array(nodes, dtype=np.int64)
+        depth = self.depth[int(nodes[0])] if len(nodes) else 0
+        parent = np.frombuffer(self.parent, dtype=np.int32)
+        move = np.frombuffer(self.move, dtype=np.int16)
+        moves = np.empty((len(nodes), depth), dtype=np.int16)
+        for k in range(depth - 1, -1, -1):
+            moves[:, k] = move[nodes]
+            nodes = parent[nodes]
+        del parent, move
+        return np.stack([moves >> 5, moves & 31], axis=2).astype(np.int8)
+
+
+_islandAgent = None
+
+
+def _initIslandWorker(agent: GeneticMinmaxAgent):
+    global _islandAgent
+    _islandAgent = agent
+    _islandAgent.islands = None
+    # the root decision is followed on the merged tree
+    _islandAgent.stableGenerations = None
+
+
+# worker job - rebuilds an island's reservation tree from its leaves, adds the new chromosomes and evolves it
+# returns the paths and values of the leaves added by this job, the island's top chromosomes and the job's counters
+def _evolveIsland(job):
+    (
+        encoding,
+        leafPaths,
+        leafValues,
+        population,
+        immigrants,
+        numGenerations,
+        initialPopulationSize,
+        maxPopulationSize,
+        deadline,
+        evalBudget,
+        seed,
+    ) = job
+    agent = _islandAgent
+    agent.deadline, agent.evalBudget, agent.numEvaluations = deadline, evalBudget, 0
+    np.random.seed(seed)
+    state = qutil.Bitboard.fromEncoding(encoding)
+    agent.prepareEvalCache(state)
+
+    counts = agent.counters()
+    if leafPaths is None:
+        tree = agent.reservationTree = ReservationTree()
+        newChromosomes = population
+    else:
+        tree = agent.reservationTree = ReservationTree.fromPaths(leafPaths, leafValues)
+        newChromosomes = immigrants
+    numNodes = len(tree)
+    if newChromosomes is not None:
+        agent.addToTree(newChromosomes, state)
+    if leafPaths is not None and immigrants is not None:
+        population = agent.uniqueChromosomes(np.concatenate([population, immigrants]))
+
+    agent.fitnessCountLimit = maxPopulationSize
+    population = agent.evolve(state, population, numGenerations, initialPopulationSize, maxPopulationSize)
+
+    # every path has the same length, so the new leaves are the new nodes at the population's depth
+    depth = np.frombuffer(tree.depth, dtype=np.int8)[numNodes:]
+    newLeaves = (np.flatnonzero(depth == population.shape[1]) + numNodes).tolist()
+    del depth
+    counts = [after - before for before, after in zip(counts, agent.counters())]
+    return tree.paths(newLeaves), [tree.value[leaf] for leaf in newLeaves], population, counts
@@ -1,6 +1,8 @@
 from quarto_agents.generic_quarto_agent import GenericQuartoAgent
 
 class HumanPlayer(GenericQuartoAgent):
+    usesGameState = True
+
     def __init__(self) -> None:
         super().__init__()
         super().setName("Human Player")
@@ -0,0 +1,173 @@
+from quarto_agents.generic_quarto_agent import GenericQuartoAgent
+import quarto_util as qutil
+import numpy as np
+import math
+import time
+
+
+class MCTSNode:
+    __slots__ = ("move", "parent", "children", "untriedMoves", "visits", "value", "result")
+
+    # A node is the position after its move (position << 5 | next piece). value is the sum of the playout results for
+    # the player who made the move, and result is the known result for that player when the node ends the game.
+    def __init__(self, move, parent, state: qutil.Bitboard) -> None:
+        self.move = move
+        self.parent = parent
+        self.children = dict()
+        self.untriedMoves = []
+        self.visits = 0
+        self.value = 0.0
+        self.result = None
+
+        if move is not None and state.isWinAt(move >> 5):
+            self.result = 1
+        elif state.occupied == qutil.FULL_MASK:
+            self.result = 0
+        elif state.winningPositions(state.currentPiece):
+            # the player to move places the given piece to win
+            self.result = -1
+        else:
+            nextPieces = state.availablePieces() or (qutil.NULL_PIECE,)
+            self.untriedMoves = [
+                position << 5 | nextPiece for position in state.availablePositions() for nextPiece in nextPieces
+            ]
+            np.random.shuffle(self.untriedMoves)
+
+
+# Monte Carlo tree search with UCT selection
+# Every expanded leaf is scored by a batch of random playouts played in lock step by qutil.randomPlayouts
+class MCTSAgent(GenericQuartoAgent):
+    usesGameState = True
+
+    def __init__(self, iterations=None, timeLimit=None, playoutBatch=256, exploration=1.0, keepTree=True) -> None:
+        super().__init__()
+        # without a time limit (seconds per move) every move runs a fixed number of iterations
+        if iterations is None and timeLimit is None:
+            iterations = 1000
+        super().setName(f"MCTS-{iterations if timeLimit is None else f'{timeLimit}s'}-{playoutBatch}")
+        self.iterations = iterations
+        self.timeLimit = timeLimit
+        self.playoutBatch = playoutBatch
+        self.exploration = exploration
+        # the subtree of the position reached after our move and the opponent's reply is kept for the next move
+        self.keepTree = keepTree
+        self.root = None
+        self.rootState = None
+        self.previousMove = None
+
+        # playout statistics
+        self.playouts = 0
+        self.searchTime = 0.0
+
+    # Only used in debugging
+    def makeFirstMove(self, quartoGameState, gui_mode=False):
+        nextPiece = int(input("Pick your opponent's first piece: "))
+        return nextPiece
+
+    def makeMove(self, quartoGameState, gui_mode=False):
+        state = quartoGameState.toBitboard()
+
+        winningMove = qutil.firstWinningMove(state)
+        if winningMove is not None:
+            position, nextPiece = winningMove
+            self.root = None
+        else:
+            (position, nextPiece), winRate = self.search(state)
+            if gui_mode:
+                print(f"MCTS agent placed piece at cell {position} and nextPiece is {nextPiece}")
+                print(f"win rate: {round(winRate, 3)}, visits: {self.root.visits}")
+
+        if gui_mode:
+            self.displayPlayoutMetrics()
+        return position, nextPiece
+
+    # the tree is not pickled with the agent
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["root"] = None
+        state["rootState"] = None
+        return state
+
+    # Returns the most visited root move and its mean result for us, scaled to [0, 1]
+    def search(self, state: qutil.Bitboard):
+        startTime = time.perf_counter()
+        self.root = self.reuseTree(state) if self.keepTree else None
+        if self.root is None:
+            self.root = MCTSNode(None, None, state)
+        self.rootState = state
+
+        deadline = None if self.timeLimit is None else startTime + self.timeLimit
+        iteration = 0
+        while True:
+            self.iterate(state.copy())
+            iteration += 1
+            if deadline is None:
+                if iteration >= self.iterations:
+                    break
+            elif time.perf_counter() > deadline:
+                break
+        self.searchTime += time.perf_counter() - startTime
+
+        move, child = max(self.root.children.items(), key=lambda item: item[1].visits)
+        self.previousMove = move
+        return (move >> 5, move & 31), (child.value / child.visits + 1) / 2
+
+    # one selection, expansion, simulation and backpropagation pass on a copy of the root state
+    def iterate(self, state: qutil.Bitboard):
+        node = self.root
+        while node.result is None and not node.untriedMoves:
+            node = self.selectChild(node)
+            state.makeMove(node.move >> 5, node.move & 31)
+
+        if node.result is None:
+            move = node.untriedMoves.pop()
+            state.makeMove(move >> 5, move & 31)
+            child = MCTSNode(move, node, state)
+            node.children[move] = child
+            node = child
+
+        # results are for the player who moved into the node - playouts are scored for the player to move
+        numResults = self.playoutBatch
+        if node.result is not None:
+            reward = node.result * numResults
+        else:
+            reward = -float(qutil.randomPlayouts(state, numResults).sum())
+            self.playouts += numResults
+
+        while node is not None:
+            node.visits += numResults
+            node.value += reward
+            reward = -reward
+            node = node.parent
+
+    def selectChild(self, node: MCTSNode):
+        logVisits = math.log(node.visits)
+        exploration = self.exploration
+        bestScore, bestChild = -math.inf, None
+        for child in node.children.values():
+            score = child.value / child.visits + exploration * math.sqrt(logVisits / child.visits)
+            if score > bestScore:
+                bestScore, bestChild = score, child
+        return bestChild
+
+    # Re-roots the previous tree onto the position reached after our move and the opponent's reply, if it was expanded
+    def reuseTree(self, state: qutil.Bitboard):
+        root, rootState = self.root, self.rootState
+        if root is None or rootState is None:
+            return None
+        move = self.previousMove
+        reply = qutil.opponentReply(rootState, (move >> 5, move & 31), state)
+        if reply is None:
+            return None
+
+        opponentPosition, opponentPiece = reply
+        grandchild = root.children[move].children.get(opponentPosition << 5 | opponentPiece)
+        if grandchild is None or grandchild.result is not None:
+            return None
+        grandchild.parent = None
+        return grandchild
+
+    def displayPlayoutMetrics(self):
+        print(f"\nplayouts: {self.playouts}, search time: {round(self.searchTime, 3)} s")
+        if self.searchTime > 0:
+            print(f"playouts per second: {round(self.playouts / self.searchTime)}\n")
@@ -1,21 +1,81 @@
-from quarto_agents.generic_quarto_agent import GenericQuartoAgent
+from quarto_agents.generic_quarto_agent import ProcessPoolAgent
+import multiprocessing as mp
 import numpy as np
-import itertools
-import pandas as pd
+import os
+import time
 import quarto_util as qutil
+import quarto_endgame as qendgame
+import quarto_book as qbook
+
+# scores are integers - a win outranks any heuristic evaluation (at most 10 three-lines)
+WIN_SCORE = 100
+INFINITY = 1000
+# half width of the root window around the previous iteration's score when principal variation search is enabled
+ASPIRATION_WINDOW = 1
+
+
+# raised inside alphaBeta when the time budget of an iterative deepening search runs out
+class SearchTimeout(Exception):
+    pass
 
 
 # NegaMax
 # Depth-limited search, move ordering, Alpha-Beta pruning, transposition table
-class NegamaxAgent(GenericQuartoAgent):
-    def __init__(self, depth, transposition=None, searchWindow=256) -> None:
+class NegamaxAgent(ProcessPoolAgent):
+    usesGameState = True
+
+    def __init__(
+        self,
+        depth,
+        transposition=None,
+        searchWindow=256,
+        tableSizeMB=None,
+        canonicalDepth=3,
+        timeLimit=None,
+        pvs=False,
+        tablebase=None,
+        book=None,
+        workers=None,
+        sharedTable=None,
+        batchLeaves=False,
+    ) -> None:
         super().__init__()
         super().setName(f"Negamax-{depth}-{searchWindow}")
         self.depth = depth
         self.searchWindow = searchWindow
+        # nodes with at least this remaining depth are looked up by their symmetry-canonical key (None disables it)
+        # canonicalizing costs more than a probe, so the shallowest nodes keep using the incremental zobrist key
+        self.canonicalDepth = canonicalDepth
+        # with a time limit (seconds per move) the agent deepens iteratively from depth 1 up to depth
+        self.timeLimit = timeLimit
+        # principal variation search - null windows for all but the first move, aspiration windows between iterations
+        self.pvs = pvs
+        # positions with few enough empty cells are looked up in the endgame tablebase tables/<name>.qeb when named
+        self.tablebase = None if tablebase is None else qendgame.EndgameTablebase.load(tablebase)
+        # opening moves are taken from the opening book tables/<name>.qob when named
+        self.book = None if book is None else qbook.OpeningBook.load(book)
+        # leaves below depth 1 nodes are scored with the vectorized batch evaluator - this only pays off in wide searches,
+        # since with good move ordering most depth 1 nodes are cut off after their first child or two
+        self.batchLeaves = batchLeaves
+        # the root moves are split across a persistent pool of this many worker processes when given
+        self.workers = workers
+        self.pool = None
+        self.sharedAlpha = None
+        self.searchId = 0
+        self.deadline = None
+        self.completedDepth = 0
+        self.hit = 0
+        self.total = 0
+        self.resetOrdering()
 
+        # the transposition table is kept in memory when a size is given and is backed by a table file in tables/ when named
+        # a qutil.SharedTranspositionTable is read and written by every process the agent is sent to
+        self.table = sharedTable
+        self.tableFileName = None
         if transposition is not None:
-            self.initTransposition(transposition)
+            self.initTransposition(transposition, tableSizeMB)
+        elif tableSizeMB is not None:
+            self.table = qutil.TranspositionTable(tableSizeMB)
 
     # Only used in debugging
     def makeFirstMove(self, quartoGameState, gui_mode=False):
@@ -23,147 +83,459 @@ class NegamaxAgent(GenericQuartoAgent):
         return nextPiece
 
     def makeMove(self, quartoGameState, gui_mode=False):
-        maxScore, (position, nextPiece) = self.alphaBeta(quartoGameState, self.depth, -1000, 1000)
+        # the search runs on a bitboard built from the game state once per move
+        state = quartoGameState.toBitboard()
+        entry = None if self.book is None else self.book.probe(state)
+        if entry is not None:
+            _, _, position, nextPiece = entry
+            if gui_mode:
+                print(f"Negamax agent played book move - placed piece at cell {position} and nextPiece is {nextPiece}\n")
+            return position, nextPiece
+
+        if self.table is not None:
+            self.table.newSearch()
+        self.ageOrdering()
+        if self.timeLimit is None:
+            maxScore, (position, nextPiece) = self.rootSearch(state, self.depth, -INFINITY, INFINITY)
+        else:
+            maxScore, (position, nextPiece) = self.iterativeDeepening(state)
         if gui_mode:
             print(
                 f"Negamax agent placed piece at cell {position} and nextPiece is {nextPiece}\n",
                 f"maxEval:  {maxScore}",
             )
+            if self.timeLimit is not None:
+                print(f"completed depth: {self.completedDepth}")
         return position, nextPiece
 
-    def alphaBeta(self, quartoGameState, depth, alpha, beta):
-        encoding, availableNextPieces, availablePositions = quartoGameState
+    # Anytime search - deepens one ply at a time until the time limit is spent and returns the result of the last
+    # completed iteration. The previous iteration's best move is searched first, so an interrupted iteration is never
+    # worse informed than the one before it. Depth 1 always completes so there is always a move to return.
+    def iterativeDeepening(self, rootState: qutil.Bitboard):
+        startTime = time.perf_counter()
+        maxDepth = min(self.depth, rootState.numEmpty())
+        result = None
+        self.completedDepth = 0
+
+        for depth in range(1, maxDepth + 1):
+            self.deadline = None if depth == 1 else startTime + self.timeLimit
+            try:
+                if result is None:
+                    result = self.rootSearch(rootState.copy(), depth, -INFINITY, INFINITY)
+                elif self.pvs:
+                    result = self.aspirationSearch(rootState, depth, result)
+                else:
+                    result = self.rootSearch(rootState.copy(), depth, -INFINITY, INFINITY, result[1])
+            except SearchTimeout:
+                break
+            self.completedDepth = depth
+
+            # a forced result does not change with more depth
+            if abs(result[0]) == WIN_SCORE or time.perf_counter() - startTime >= self.timeLimit:
+                break
+
+        self.deadline = None
+        return result
+
+    # Searches the root with a narrow window around the previous score - the searches are fail-soft, so a result outside
+    # the window is a bound in the direction it failed and only that side of the window has to be reopened
+    def aspirationSearch(self, rootState: qutil.Bitboard, depth, previousResult):
+        previousScore, firstMove = previousResult
+        alpha = max(previousScore - ASPIRATION_WINDOW, -INFINITY)
+        beta = min(previousScore + ASPIRATION_WINDOW, INFINITY)
+        while True:
+            result = self.rootSearch(rootState.copy(), depth, alpha, beta, firstMove)
+            if result[0] <= alpha and alpha > -INFINITY:
+                alpha = -INFINITY
+            elif result[0] >= beta and beta < INFINITY:
+                beta = INFINITY
+            else:
+                return result
+            firstMove = result[1]
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["sharedAlpha"] = None
+        return state
+
+    def rootSearch(self, state: qutil.Bitboard, depth, alpha, beta, firstMove=None):
+        if (
+            self.workers is None
+            or depth < 2
+            or not self.canStartPool()
+            or state.winningPositions(state.currentPiece)
+            or (self.tablebase is not None and self.tablebase.covers(state))
+        ):
+            return self.alphaBeta(state, depth, alpha, beta, firstMove)
+        return self.parallelSearch(state, depth, alpha, beta, firstMove)
+
+    """
+    Root splitting - the first root move is searched here with the full window to establish alpha, then the remaining
+    root moves are searched by the worker pool in their ordering. Each worker starts a move with the best alpha reported
+    so far through shared memory and reports back any improvement, so later subtrees are pruned by earlier results.
+    Fail-soft results at or below the alpha a move was searched with are only upper bounds. Any earlier move with such a
+    bound equal to the best score is re-searched with a window just below it, so the chosen move is the first move of
+    the ordering reaching the best score.
+    Every worker starts a search from this agent's ordering state, and the moves of each node are chosen by the history at
+    the start of the search (see orderMoves), so all processes search the same tree. Without a transposition table this
+    returns the same move and score as a serial search from the same ordering state at a fixed depth, however the root
+    moves are shared out. The cutoffs found by the workers stay in the workers, so the ordering state of a parallel and
+    a serial agent drift apart over a game.
+    """
+    def parallelSearch(self, state: qutil.Bitboard, depth, alpha, beta, firstMove=None):
+        self.startPool()
         self.total += 1
 
-        if qutil.isGameOverEncoding(encoding):
-            return -np.inf, (16, 16)
-        if depth == 0 or len(availablePositions) == 0:
-            return self.evaluation(encoding), (16, 16)
+        if self.canonicalDepth is not None and depth >= self.canonicalDepth:
+            key, transform = state.canonicalKey()
+        else:
+            key, transform = state.key, None
+        tableMove = None
+        if firstMove is not None:
+            tableMove = firstMove[0] << 5 | firstMove[1]
+        elif self.table is not None:
+            entry = self.table.probe(key)
+            if entry is not None:
+                position, piece = entry[3], entry[4]
+                if transform is not None:
+                    position, piece = qutil.inverseTransformMove(transform, position, piece)
+                tableMove = position << 5 | piece
+        moves = self.orderMoves(state, depth, tableMove)[: self.searchWindow]
 
-        # check transposition table
-        if self.tableFileName is not None:
-            if encoding in self.table.encoding.values:
-                self.hit += 1
-                row = self.table[self.table["encoding"] == encoding].values[0]
-                return row[1], (row[2], row[3])
+        # the first move is searched alone, as a serial search would
+        alphaOrig = alpha
+        position, nextPiece = moves[0] >> 5, moves[0] & 31
+        state.makeMove(position, nextPiece)
+        maxScore = -self.alphaBeta(state, depth - 1, -beta, -alpha)[0]
+        state.unmakeMove(position, nextPiece)
+        bestIndex = 0
+        alpha = max(alpha, maxScore)
 
-        if len(availableNextPieces) == 0:
-            availableNextPieces.add(16)
+        if alpha < beta and len(moves) > 1:
+            self.searchId += 1
+            with self.sharedAlpha.get_lock():
+                self.sharedAlpha[0] = self.searchId
+                self.sharedAlpha[1] = alpha
+            encoding = state.toEncoding()
+            jobs = [
+                (self.searchId, encoding, move, depth, alpha, beta, self.deadline, self.windowHistory)
+                for move in moves[1:]
+            ]
+            results = self.pool.map(_searchRootMove, jobs, chunksize=1)
+            if None in results:
+                raise SearchTimeout()
 
-        maxScore = -np.inf
-        bestMove = (16, 16)
+            # results are (score, alpha it was searched with) - scores above that alpha are exact or fail high
+            results = [(maxScore, alphaOrig, 0)] + results
+            self.total += sum(nodes for _, _, nodes in results)
+            failHigh = [i for i, (value, alphaUsed, _) in enumerate(results) if value >= beta and value > alphaUsed]
+            if failHigh:
+                bestIndex = failHigh[0]
+                maxScore = results[bestIndex][0]
+            else:
+                maxScore = max(value for value, _, _ in results)
+                candidates = [i for i, (value, _, _) in enumerate(results) if value == maxScore]
+                exact = [i for i in candidates if i == 0 or results[i][0] > results[i][1]]
+                bestIndex = exact[0] if exact else candidates[0]
 
-        """
-        The move ordering for the search window is as follows - We cycle through all available positions for a single next piece before considering
-        another next piece. This way all positions are prioritized and explored first over exploring all next pieces for a single position.
-        """
-        searchWindowCounter = 0
-        for move in itertools.product(availableNextPieces, availablePositions):
-            searchWindowCounter += 1
-            if searchWindowCounter > self.searchWindow:
-                break
+                # an upper bound equal to the best score may hide an earlier move reaching it
+                for i in candidates:
+                    if i >= bestIndex:
+                        break
+                    position, nextPiece = moves[i] >> 5, moves[i] & 31
+                    state.makeMove(position, nextPiece)
+                    value = -self.alphaBeta(state, depth - 1, -beta, -(maxScore - 1))[0]
+                    state.unmakeMove(position, nextPiece)
+                    if value >= maxScore:
+                        bestIndex = i
+                        break
+
+        bestMove = (moves[bestIndex] >> 5, moves[bestIndex] & 31)
+        if self.table is not None:
+            if maxScore <= alphaOrig:
+                flag = qutil.UPPER_BOUND
+            elif maxScore >= beta:
+                flag = qutil.LOWER_BOUND
+            else:
+                flag = qutil.EXACT
+            position, piece = bestMove
+            if transform is not None:
+                position, piece = qutil.transformMove(transform, position, piece)
+            self.table.store(key, maxScore, depth, flag, position, piece)
+        return maxScore, bestMove
 
-            # switch move indices to match format: (position, nextPiece)
-            move = (move[1], move[0])
+    # every worker holds its own copy of this agent and its tables
+    def poolConfig(self):
+        self.sharedAlpha = mp.Array("i", [0, -INFINITY])
+        return self.workers, _initSearchWorker, (self, self.sharedAlpha)
 
-            # simulate move
-            nextEncoding = qutil.getEncodingAfterMove(encoding, move[0], move[1])
-            availablePositions.remove(move[0])
-            availableNextPieces.remove(move[1])
-            nextGameState = (nextEncoding, availableNextPieces, availablePositions)
+    def closePool(self):
+        super().closePool()
+        self.sharedAlpha = None
 
-            # call for next turn
-            curr = -self.alphaBeta(nextGameState, depth - 1, -beta, -alpha)[0]
-            if curr >= maxScore:
+    def alphaBeta(self, state: qutil.Bitboard, depth, alpha, beta, firstMove=None):
+        self.total += 1
+        if self.deadline is not None and self.total & 1023 == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+        if depth == 0 or state.occupied == qutil.FULL_MASK:
+            return self.evaluation(state), (16, 16)
+
+        # an immediate win is the best possible result, so it ends the search of this node before anything else
+        # this also means that no placement searched below completes a line
+        winningMove = qutil.firstWinningMove(state)
+        if winningMove is not None:
+            return WIN_SCORE, winningMove
+
+        # endgame positions in the tablebase have an exact result
+        if self.tablebase is not None and self.tablebase.covers(state):
+            entry = self.tablebase.probe(state)
+            if entry is not None:
+                value, position, piece = entry
+                return value * WIN_SCORE, (position, piece)
+
+        # check transposition table - exact entries are returned, bounds narrow the window
+        alphaOrig = alpha
+        tableMove = None
+        transform = None
+        if self.table is not None:
+            if self.canonicalDepth is not None and depth >= self.canonicalDepth:
+                key, transform = state.canonicalKey()
+            else:
+                key = state.key
+            entry = self.table.probe(key)
+            if entry is not None:
+                value, entryDepth, flag, position, piece = entry
+                if transform is not None:
+                    # moves are stored for the canonical position
+                    position, piece = qutil.inverseTransformMove(transform, position, piece)
+                if entryDepth >= depth:
+                    if flag == qutil.EXACT:
+                        self.hit += 1
+                        return value, (position, piece)
+                    elif flag == qutil.LOWER_BOUND:
+                        alpha = max(alpha, value)
+                    else:
+                        beta = min(beta, value)
+                    if alpha >= beta:
+                        self.hit += 1
+                        return value, (position, piece)
+                tableMove = position << 5 | piece
+        if firstMove is not None:
+            tableMove = firstMove[0] << 5 | firstMove[1]
+
+        maxScore = -WIN_SCORE
+        bestMove = (16, 16)
+
+        # only the best searchWindow moves of the ordering are searched
+        moves = self.orderMoves(state, depth, tableMove)
+        # the children of depth 1 nodes are leaves, scored in one batch instead of being played one by one
+        leafScores = self.evaluateLeaves(state) if depth == 1 and self.batchLeaves else None
+        for i in range(min(len(moves), self.searchWindow)):
+            move = moves[i]
+            position, nextPiece = move >> 5, move & 31
+
+            if leafScores is not None:
+                self.total += 1
+                curr = leafScores[position]
+            else:
+                state.makeMove(position, nextPiece)
+                if self.pvs and i > 0:
+                    # the first move is assumed best - the others only have to be proven worse with a null window
+                    curr = -self.alphaBeta(state, depth - 1, -alpha - 1, -alpha)[0]
+                    if alpha < curr < beta:
+                        curr = -self.alphaBeta(state, depth - 1, -beta, -alpha)[0]
+                else:
+                    curr = -self.alphaBeta(state, depth - 1, -beta, -alpha)[0]
+                state.unmakeMove(position, nextPiece)
+
+            # ties keep the earlier move - a later move scoring the same may only be bounded by it
+            if curr > maxScore or i == 0:
                 maxScore = curr
-                bestMove = move
+                bestMove = (position, nextPiece)
             alpha = max(alpha, maxScore)
 
-            # undo simulated move
-            availablePositions.add(move[0])
-            availableNextPieces.add(move[1])
-
-            if alpha > beta:
-                if self.tableFileName is not None and depth == self.depth:
-                    self.updateTable([encoding, maxScore, bestMove[0], bestMove[1]])
-                availableNextPieces.discard(16)
-                return alpha, bestMove
+            if alpha >= beta:
+                self.updateOrdering(move, depth, i)
+                break
 
-        if self.tableFileName is not None and depth == self.depth:
-            self.updateTable([encoding, maxScore, bestMove[0], bestMove[1]])
-        availableNextPieces.discard(16)
+        if self.table is not None:
+            if maxScore <= alphaOrig:
+                flag = qutil.UPPER_BOUND
+            elif maxScore >= beta:
+                flag = qutil.LOWER_BOUND
+            else:
+                flag = qutil.EXACT
+            position, piece = bestMove
+            if transform is not None:
+                position, piece = qutil.transformMove(transform, position, piece)
+            self.table.store(key, maxScore, depth, flag, position, piece)
         return maxScore, bestMove
 
+    """
+    Move ordering - moves are encoded as position << 5 | nextPiece and tried in this order:
+    the previous iteration's best move (at the root) or the transposition table move, then the killer moves of this depth,
+    then all remaining moves by their history score. Ties keep the original ordering, which cycles through all available
+    positions for a single next piece before considering another next piece.
+    Only the first searchWindow moves are returned. Which moves those are is decided by the table move and the history
+    as it was at the start of the search (windowHistory), so the moves of a node do not depend on the subtrees searched
+    before it - the killers and the history gained during the search only reorder them.
+    Immediate wins are handled before ordering since they end the search of a node straight away.
+    """
+    def orderMoves(self, state: qutil.Bitboard, depth, tableMove):
+        availableNextPieces = state.availablePieces() or (16,)
+        availablePositions = state.availablePositions()
+        moves = [
+            position << 5 | nextPiece for nextPiece in availableNextPieces for position in availablePositions
+        ]
+        if tableMove is not None and (
+            state.occupied >> (tableMove >> 5) & 1 or (tableMove & 31) not in availableNextPieces
+        ):
+            tableMove = None
+        if len(moves) > self.searchWindow:
+            moves.sort(key=self.windowHistory.__getitem__, reverse=True)
+            if tableMove is not None:
+                moves.remove(tableMove)
+                moves.insert(0, tableMove)
+            del moves[self.searchWindow :]
+        moves.sort(key=self.history.__getitem__, reverse=True)
+
+        first = []
+        for move in (tableMove, *self.killers[depth]):
+            if move is not None and move not in first and move in moves:
+                first.append(move)
+        if first:
+            moves = first + [move for move in moves if move not in first]
+        return moves
+
+    # a move causing a beta cutoff becomes a killer move for its depth and gains history score
+    def updateOrdering(self, move, depth, moveIndex):
+        self.cutoffs += 1
+        if moveIndex == 0:
+            self.firstMoveCutoffs += 1
+        killers = self.killers[depth]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        self.history[move] += depth * depth
+
+    def resetOrdering(self):
+        self.setOrdering([0] * 512)
+        self.cutoffs = 0
+        self.firstMoveCutoffs = 0
+
+    # history scores are aged between moves so that old cutoffs do not dominate the ordering
+    def ageOrdering(self):
+        self.setOrdering([score >> 1 for score in self.history])
+
+    # the ordering state a search starts from - parallel search workers are given the one of the agent they search for
+    def setOrdering(self, history):
+        self.killers = [[None, None] for _ in range(17)]
+        self.history = list(history)
+        self.windowHistory = list(history)
+
+    def displaySearchMetrics(self):
+        print(f"\nnodes searched: {self.total}, beta cutoffs: {self.cutoffs}")
+        if self.cutoffs != 0:
+            print(f"first move cutoff rate: {round((self.firstMoveCutoffs/self.cutoffs)*100,2)} %\n")
+
     # Counts how many lines of three pieces with an identical property
-    def evaluation(self, encoding):
-        board = [int(encoding[i] + encoding[i + 1]) for i in range(0, len(encoding) - 2, 2)]
-        tempLine = None
-        numLines = 0
-
-        for i in range(4):
-            # check horizontal lines
-            tempLine = board[4 * i : 4 * (i + 1)]
-            if tempLine.count(16) == 1:
-                tempLine.remove(16)
-                if qutil.matchingPropertyExists(tempLine):
-                    numLines += 1
-
-            tempLine = board[i : len(board) : 4]
-            # check vertical lines
-            if tempLine.count(16) == 1:
-                tempLine.remove(16)
-                if qutil.matchingPropertyExists(tempLine):
-                    numLines += 1
-
-        # check obtuse diagonal line
-        tempLine = board[0 : len(board) : 5]
-        if tempLine.count(16) == 1:
-            tempLine.remove(16)
-            if qutil.matchingPropertyExists(tempLine):
-                numLines += 1
-
-        # check acute diagonal line:
-        tempLine = board[3:-1:3]
-        if tempLine.count(16) == 1:
-            tempLine.remove(16)
-            if qutil.matchingPropertyExists(tempLine):
-                numLines += 1
-
-        # no winning line found
-        return numLines
-
-    def initTransposition(self, transposition):
-        self.hit = 0
-        self.total = 0
+    def evaluation(self, state: qutil.Bitboard):
+        return state.countThreeLines()
+
+    # Batched counterpart of evaluation for all children of a depth 1 node - a leaf's score only depends on where the
+    # current piece is placed, so one board per empty cell is scored. Returns the negated scores indexed by position.
+    def evaluateLeaves(self, state: qutil.Bitboard):
+        positions = state.availablePositions()
+        boards = np.tile(state.toArray(), (len(positions), 1))
+        boards[np.arange(len(positions)), positions] = state.currentPiece
+        leafScores = [0] * 16
+        for position, threeLines in zip(positions, qutil.evaluateBoards(boards)[1].tolist()):
+            leafScores[position] = -threeLines
+        return leafScores
+
+    # Newly learned entries go to a private in-memory table, while tables/<name>.qtt is memory-mapped read-only behind it.
+    # Legacy pickled tables are converted to the table file format the first time they are opened.
+    def initTransposition(self, transposition, tableSizeMB=None):
         self.tableFileName = transposition
-        self.table = pd.read_pickle(f"tables/{transposition}.pkl")
-
-    def updateTable(self, record):
-        if record[1] == np.inf:
-            record[1] = 10
-        if record[1] == -np.inf:
-            record[1] = -10
-        row = {
-            "encoding": record[0],
-            "evaluation": record[1],
-            "movePos": record[2],
-            "movePiece": record[3],
-        }
-        self.table = self.table.append(row, ignore_index=True)
-
-        self.table["encoding"] = self.table["encoding"].astype("str")
-        self.table["evaluation"] = self.table["evaluation"].astype("int8")
-        self.table["movePos"] = self.table["movePos"].astype("int8")
-        self.table["movePiece"] = self.table["movePiece"].astype("int8")
+        if self.table is None:
+            self.table = qutil.TranspositionTable(tableSizeMB or qutil.DEFAULT_TABLE_SIZE_MB)
 
+        path = qutil.getTablePath(transposition)
+        if not os.path.exists(path) and os.path.exists(f"tables/{transposition}.pkl"):
+            print(f"Converting legacy table tables/{transposition}.pkl to {path}")
+            qutil.convertLegacyTable(transposition, self.depth, winScore=WIN_SCORE)
+        if os.path.exists(path):
+            self.table.fallback = qutil.openTableFile(path)
+
+    # merges the entries learned in this process into the table file
     def saveTable(self):
-        self.table.to_pickle(f"tables/{self.tableFileName}.pkl")
+        qutil.mergeIntoTableFile(self.table, qutil.getTablePath(self.tableFileName))
+        if self.table.fallback is None:
+            self.table.fallback = qutil.openTableFile(qutil.getTablePath(self.tableFileName))
 
     def displayTranspositionMetrics(self):
-        if self.tableFileName is None:
+        if self.table is None:
             print("No transposition table was loaded. Cannot display any transposition metrics.")
         else:
             print("\nnum hits: ", self.hit, "\nnum total: ", self.total, "")
             if self.total != 0:
                 print(f"hit rate: {round((self.hit/self.total)*100,2)} %\n")
-            print(self.table.info(), "\n")
+            print(
+                f"table probes: {self.table.probes}, key matches: {self.table.hits}, stores: {self.table.stores}",
+                f"\nentries used: {self.table.numUsed()} / {len(self.table)} ({round(self.table.sizeMB(), 2)} MB)\n",
+            )
+            if isinstance(self.table, qutil.SharedTranspositionTable):
+                probes, hits, stores = self.table.globalStats()
+                print(f"shared table - all processes: probes {probes}, key matches {hits}, stores {stores}")
+                if probes != 0:
+                    print(f"global key match rate: {round((hits/probes)*100,2)} %\n")
+        if self.tablebase is not None:
+            print(f"tablebase probes: {self.tablebase.probes}, tablebase hits: {self.tablebase.hits}\n")
+
+
+_searchWorker = None
+_sharedAlpha = None
+
+
+def _initSearchWorker(agent: NegamaxAgent, sharedAlpha):
+    global _searchWorker, _sharedAlpha
+    _searchWorker = agent
+    _searchWorker.workers = None
+    _sharedAlpha = sharedAlpha
+
+
+# worker job - searches one root move with the best alpha known so far
+# returns (score, alpha it was searched with, nodes searched), or None if the deadline passed
+def _searchRootMove(job):
+    searchId, encoding, move, depth, alpha, beta, deadline, windowHistory = job
+    agent = _searchWorker
+    if agent.searchId != searchId:
+        agent.searchId = searchId
+        if agent.table is not None:
+            agent.table.newSearch()
+        agent.setOrdering(windowHistory)
+    if deadline is not None and time.perf_counter() > deadline:
+        return None
+
+    if _sharedAlpha[0] == searchId:
+        alpha = max(alpha, _sharedAlpha[1])
+    if alpha >= beta:
+        return alpha, alpha, 0
+
+    state = qutil.Bitboard.fromEncoding(encoding)
+    state.makeMove(move >> 5, move & 31)
+    nodes = agent.total
+    agent.deadline = deadline
+    try:
+        value = -agent.alphaBeta(state, depth - 1, -beta, -alpha)[0]
+    except SearchTimeout:
+        return None
+    finally:
+        agent.deadline = None
+
+    if value > alpha:
+        with _sharedAlpha.get_lock():
+            if _sharedAlpha[0] == searchId and value > _sharedAlpha[1]:
+                _sharedAlpha[1] = value
+    return value, alpha, agent.total - nodes
@@ -2,16 +2,18 @@ from quarto_agents.generic_quarto_agent import GenericQuartoAgent
 from numpy import random
 
 class RandomAgent(GenericQuartoAgent):
+    usesGameState = True
+
     def __init__(self) -> None:
         super().__init__()
         super().setName("Random Agent")
 
     def makeFirstMove(self, quartoGameState, gui_mode=False):
-        nextPiece = int(random.choice(list(quartoGameState[1])))
+        nextPiece = int(random.choice(quartoGameState.availablePieces()))
         return nextPiece
     
     def makeMove(self, quartoGameState, gui_mode=False):
-        position = int(random.choice(list(quartoGameState[2])))
-        nextPiece = int(random.choice(list(quartoGameState[1])))
+        position = int(random.choice(quartoGameState.availablePositions()))
+        nextPiece = int(random.choice(quartoGameState.availablePieces()))
         if gui_mode: print(f"Random agent placed piece at cell {position} and nextPiece is {nextPiece}")
         return position, nextPiece
\ No newline at end of file
@@ -0,0 +1,212 @@
+import numpy as np
+import quarto_util as qutil
+import argparse
+import time
+
+"""
+Batch game engine - N games are held as NumPy arrays and advanced one ply per step in lock step. Every step asks each
+player's policy for the moves of all the games it is to move in at once, applies them with the packed line state of
+qutil.LineTracker kept for every game in an (N, 11) array, detects wins in all games together and retires finished games.
+
+Games follow QuartoGame.play - player 1 hands out a first piece (random unless given), player 2 places it, and the last
+piece is placed by the engine. Results are 1 or 2 for the winning player, 0 for a draw, and -1 or -2 when that player
+made an invalid move.
+
+A policy is called as policy(games, rows) with the engine and the indices of the games it is to move in, and returns
+the arrays of positions and next pieces for those games.
+"""
+
+CELL_BITS = 1 << np.arange(16)
+
+
+class BatchQuartoGame:
+    def __init__(self, numGames: int, firstPieces=None) -> None:
+        self.numGames = numGames
+        self.cells = np.full((numGames, 16), qutil.NULL_PIECE, dtype=np.int8)
+        self.lines = np.full((numGames, 11), qutil.EMPTY_LINE, dtype=np.int32)
+        self.occupied = np.zeros(numGames, dtype=np.int32)
+        self.pieces = np.full(numGames, qutil.FULL_MASK, dtype=np.int32)
+        if firstPieces is None:
+            firstPieces = np.random.randint(16, size=numGames)
+        self.currentPiece = np.asarray(firstPieces, dtype=np.int32).copy()
+        self.pieces &= ~(1 << self.currentPiece)
+        self.playerToMove = np.full(numGames, 2, dtype=np.int8)
+
+        # move history (position, next piece) of every ply, and the games still being played
+        self.moves = np.full((numGames, 16, 2), -1, dtype=np.int8)
+        self.numPlies = np.zeros(numGames, dtype=np.int32)
+        self.results = np.zeros(numGames, dtype=np.int8)
+        self.active = np.arange(numGames)
+
+    def __len__(self):
+        return self.numGames
+
+    def numActive(self):
+        return len(self.active)
+
+    # encoding of game i as used by QuartoGame and the agents
+    def encoding(self, i: int):
+        return "".join(f"{piece:02d}" for piece in self.cells[i].tolist()) + f"{int(self.currentPiece[i]):02d}"
+
+    def bitboard(self, i: int):
+        return qutil.Bitboard.fromEncoding(self.encoding(i))
+
+    # game i as the state QuartoGame passes to agents
+    def gameState(self, i: int):
+        occupied = int(self.occupied[i])
+        cells = sum(int(self.cells[i, position]) << 4 * position for position in qutil.bitIndices(occupied))
+        return qutil.GameState(cells, occupied, int(self.pieces[i]), int(self.currentPiece[i]))
+
+    # one ply of every active game - returns the number of games still being played
+    def step(self, policy1, policy2):
+        rows = self.active
+        positions = np.zeros(len(rows), dtype=np.int64)
+        nextPieces = np.full(len(rows), qutil.NULL_PIECE, dtype=np.int64)
+
+        # the last piece goes on the last empty cell without asking the player
+        last = self.numPlies[rows] == 15
+        positions[last] = np.log2(qutil.FULL_MASK ^ self.occupied[rows[last]]).astype(np.int64)
+        for player, policy in ((1, policy1), (2, policy2)):
+            toMove = ~last & (self.playerToMove[rows] == player)
+            if toMove.any():
+                playerPositions, playerPieces = policy(self, rows[toMove])
+                positions[toMove] = playerPositions
+                nextPieces[toMove] = playerPieces
+
+        self.applyMoves(rows, positions, nextPieces, last)
+        return len(self.active)
+
+    def applyMoves(self, rows, positions, nextPieces, last):
+        mover = self.playerToMove[rows]
+        free = self.occupied[rows] >> positions & 1 == 0
+        available = self.pieces[rows] >> np.minimum(nextPieces, 15) & 1 == 1
+        valid = (positions >= 0) & (positions < 16) & free & (last | (nextPieces >= 0) & (nextPieces < 16) & available)
+        self.results[rows[~valid]] = -mover[~valid]
+        finished = ~valid
+
+        rows, positions, nextPieces, mover = rows[valid], positions[valid], nextPieces[valid], mover[valid]
+        piece = self.currentPiece[rows][:, None]
+        cellLines = qutil.CELL_LINE_INDICES[positions]
+        line = self.lines[rows[:, None], cellLines]
+        line = (line & piece) | (line & (~piece & 15) << 4) | ((line >> 8) + 1) << 8
+        self.lines[rows[:, None], cellLines] = line
+        won = ((line >> 8 == 4) & ((line | line >> 4) & 15 != 0) & (cellLines != 10)).any(axis=1)
+
+        self.cells[rows, positions] = piece[:, 0]
+        self.occupied[rows] |= CELL_BITS[positions]
+        self.pieces[rows] &= ~np.where(nextPieces < 16, CELL_BITS[np.minimum(nextPieces, 15)], 0)
+        self.currentPiece[rows] = nextPieces
+        self.moves[rows, self.numPlies[rows]] = np.stack([positions, nextPieces], axis=1)
+        self.numPlies[rows] += 1
+        self.playerToMove[rows] = 3 - mover
+
+        # a full board without a win is a draw, which is the initial result
+        self.results[rows[won]] = mover[won]
+        finished[valid] = won | (self.occupied[rows] == qutil.FULL_MASK)
+        self.active = self.active[~finished]
+
+    # plays every game to the end and returns the results
+    def play(self, policy1, policy2):
+        while len(self.active):
+            self.step(policy1, policy2)
+        return self.results
+
+    # (player 1 wins, player 2 wins, draws, invalid games)
+    def summary(self):
+        results = self.results
+        return (
+            int(np.count_nonzero(results == 1)),
+            int(np.count_nonzero(results == 2)),
+            int(np.count_nonzero(results == 0)),
+            int(np.count_nonzero(results < 0)),
+        )
+
+
+# uniformly random empty cell and available next piece
+def randomPolicy(games: BatchQuartoGame, rows):
+    free = games.occupied[rows, None] & CELL_BITS == 0
+    positions = np.argmax(np.where(free, np.random.random((len(rows), 16)), -1), axis=1)
+    available = games.pieces[rows, None] & CELL_BITS != 0
+    nextPieces = np.argmax(np.where(available, np.random.random((len(rows), 16)), -1), axis=1)
+    return positions, nextPieces
+
+
+# pieces that complete a line holding three pieces, indexed by the AND and NOR bytes of its packed line word
+COMPLETING_PIECES = np.array(
+    [
+        sum(1 << piece for piece in range(16) if (common & 15 & piece) | (common >> 4 & ~piece & 15))
+        for common in range(256)
+    ],
+    dtype=np.int32,
+)
+
+
+# (games, 11) masks of the pieces that complete each line - the padding line never completes
+def _completingPieces(lines):
+    completing = np.where(lines >> 8 == 3, COMPLETING_PIECES[lines & 0xFF], 0)
+    completing[:, 10] = 0
+    return completing
+
+
+# Wins at once when the current piece allows it and otherwise places at random, then hands out a random piece the
+# opponent cannot win with right away if there is one
+def greedyPolicy(games: BatchQuartoGame, rows):
+    lines = games.lines[rows]
+    free = games.occupied[rows, None] & CELL_BITS == 0
+    piece = games.currentPiece[rows]
+    cellPieces = np.bitwise_or.reduce(_completingPieces(lines)[:, qutil.CELL_LINE_INDICES], axis=2)
+    wins = cellPieces >> piece[:, None] & 1
+    keys = np.random.random((len(rows), 16)) + 2 * wins
+    positions = np.argmax(np.where(free, keys, -1), axis=1)
+
+    # line state after placing the piece - every line with three pieces has its empty cell free
+    rowIndices = np.arange(len(rows))[:, None]
+    cellLines = qutil.CELL_LINE_INDICES[positions]
+    line = lines[rowIndices, cellLines]
+    placed = piece[:, None]
+    lines[rowIndices, cellLines] = (line & placed) | (line & (~placed & 15) << 4) | ((line >> 8) + 1) << 8
+    unsafe = np.bitwise_or.reduce(_completingPieces(lines), axis=1)
+
+    available = games.pieces[rows, None] & CELL_BITS != 0
+    safe = unsafe[:, None] & CELL_BITS == 0
+    keys = np.random.random((len(rows), 16)) + 2 * safe
+    nextPieces = np.argmax(np.where(available, keys, -1), axis=1)
+    return positions, nextPieces
+
+
+# adapter for any GenericQuartoAgent - the agent is asked for each game in turn
+def agentPolicy(agent):
+    def policy(games: BatchQuartoGame, rows):
+        moves = [agent.makeMove(qutil.agentGameState(agent, games.gameState(i))) for i in rows.tolist()]
+        positions, nextPieces = zip(*moves)
+        return np.array(positions), np.array(nextPieces)
+
+    return policy
+
+
+POLICIES = {"random": randomPolicy, "greedy": greedyPolicy}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play a batch of games between two batched policies")
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--player1", choices=POLICIES, default="random")
+    parser.add_argument("--player2", choices=POLICIES, default="random")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        np.random.seed(args.seed)
+    start_time = time.time()
+    games = BatchQuartoGame(args.games)
+    games.play(POLICIES[args.player1], POLICIES[args.player2])
+    elapsed = time.time() - start_time
+
+    player1Wins, player2Wins, draws, invalid = games.summary()
+    print(f"{args.player1} vs {args.player2}: {args.games} games in {round(elapsed, 2)}s")
+    print(f"player 1 wins: {player1Wins}, player 2 wins: {player2Wins}, draws: {draws}, invalid: {invalid}")
+    print(f"games per minute: {round(60 * args.games / elapsed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import numpy as np
+import quarto_util as qutil
+import multiprocessing as mp
+import argparse
+import os
+import time
+
+"""
+Opening book - best moves of early positions found by deep offline searches, keyed on the canonical position key
+so that every symmetric variation of a position shares one entry.
+
+The first piece handed out on the empty board does not need an entry - the complement and attribute permutation
+symmetries map every piece onto every other piece, so all first pieces are equivalent.
+
+File layout - a 16-byte header (magic, version, number of entries) followed by the entries sorted by key:
+    key (8 bytes), score (2 bytes), depth, position and piece (1 byte each) - moves are stored in the canonical frame
+"""
+
+BOOK_HEADER = np.dtype([("magic", "S4"), ("version", "<u4"), ("numEntries", "<u8")])
+BOOK_ENTRY = np.dtype(
+    [("key", "<u8"), ("score", "<i2"), ("depth", "u1"), ("position", "u1"), ("piece", "u1")]
+)
+BOOK_MAGIC = b"QOBK"
+BOOK_VERSION = 1
+
+
+def getBookPath(file_name: str):
+    return f"tables/{file_name}.qob"
+
+
+class OpeningBook:
+    def __init__(self, path=None) -> None:
+        # canonical key -> (score, depth, position, piece)
+        self.entries = dict()
+        self.path = path
+        self.probes = 0
+        self.hits = 0
+        if path is not None and os.path.exists(path):
+            self.read(path)
+
+    @classmethod
+    def load(cls, file_name: str):
+        return cls(getBookPath(file_name))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def read(self, path: str):
+        with open(path, "rb") as f:
+            header = np.frombuffer(f.read(BOOK_HEADER.itemsize), dtype=BOOK_HEADER)[0]
+            assert header["magic"] == BOOK_MAGIC, f"{path} is not an opening book file."
+            assert header["version"] == BOOK_VERSION, f"Unsupported opening book version {header['version']}."
+            entries = np.frombuffer(f.read(), dtype=BOOK_ENTRY, count=int(header["numEntries"]))
+        for key, score, depth, position, piece in entries.tolist():
+            self.entries[key] = (score, depth, position, piece)
+
+    def save(self, path=None):
+        path = path or self.path
+        entries = np.array(
+            sorted((key, *entry) for key, entry in self.entries.items()), dtype=BOOK_ENTRY
+        )
+        header = np.array([(BOOK_MAGIC, BOOK_VERSION, len(entries))], dtype=BOOK_HEADER)
+        with open(path + ".tmp", "wb") as f:
+            f.write(header.tobytes())
+            f.write(entries.tobytes())
+        os.replace(path + ".tmp", path)
+
+    # keeps the deepest search of a position
+    def add(self, key, score, depth, position, piece):
+        entry = self.entries.get(key)
+        if entry is None or entry[1] <= depth:
+            self.entries[key] = (score, depth, position, piece)
+
+    # returns (score, depth, position, piece) for the position, or None if it is not in the book
+    def probe(self, state: qutil.Bitboard):
+        self.probes += 1
+        key, transform = state.canonicalKey()
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.hits += 1
+        score, depth, position, piece = entry
+        return (score, depth, *qutil.inverseTransformMove(transform, position, piece))
+
+
+# every canonical position after the first plies placements, one representative each
+def openingPositions(plies: int):
+    state = qutil.Bitboard()
+    state.makeFirstMove(0)
+    frontier = {state.canonicalKey()[0]: state}
+    positions = dict(frontier)
+    for _ in range(plies):
+        nextFrontier = dict()
+        for state in frontier.values():
+            for nextPiece in state.availablePieces():
+                for position in state.availablePositions():
+                    child = state.copy()
+                    child.makeMove(position, nextPiece)
+                    if child.isGameOver():
+                        continue
+                    key = child.canonicalKey()[0]
+                    if key not in positions and key not in nextFrontier:
+                        nextFrontier[key] = child
+        positions.update(nextFrontier)
+        frontier = nextFrontier
+    return [state.toEncoding() for state in positions.values()]
+
+
+# positions of the detailed game logs with at least minEmpty empty cells and a piece to place
+def logPositions(logDir: str, minEmpty: int):
+    return [
+        state.toEncoding()
+        for state in qutil.loggedPositions(logDir)
+        if state.numEmpty() >= minEmpty and state.currentPiece != qutil.NULL_PIECE
+    ]
+
+
+_searchAgent = None
+_infinity = None
+
+
+# each worker keeps one search agent, so its transposition table carries over between positions
+def _initWorker(depth, searchWindow, tableSizeMB):
+    global _searchAgent, _infinity
+    from quarto_agents.negamax_agent import NegamaxAgent, INFINITY
+
+    _searchAgent = NegamaxAgent(depth, searchWindow=searchWindow, tableSizeMB=tableSizeMB)
+    _infinity = INFINITY
+
+
+# worker job - searches one position and returns its book entry in the canonical frame
+def _searchPosition(encoding):
+    state = qutil.Bitboard.fromEncoding(encoding)
+    key, transform = state.canonicalKey()
+    _searchAgent.table.newSearch()
+    _searchAgent.ageOrdering()
+    score, (position, piece) = _searchAgent.alphaBeta(state, _searchAgent.depth, -_infinity, _infinity)
+    return key, score, _searchAgent.depth, *qutil.transformMove(transform, position, piece)
+
+
+# Offline builder - searches every opening position (and log position) that the book does not yet hold at the
+# requested depth on a process pool. The book is saved every saveInterval results, so an interrupted build resumes by
+# running it again, and later runs extend the book incrementally.
+def buildBook(
+    file_name: str,
+    plies=1,
+    depth=3,
+    searchWindow=256,
+    logDir=None,
+    minEmpty=12,
+    processes=None,
+    tableSizeMB=16,
+    saveInterval=20,
+):
+    book = OpeningBook.load(file_name)
+    encodings = openingPositions(plies)
+    if logDir is not None:
+        encodings += logPositions(logDir, minEmpty)
+
+    pending = dict()
+    for encoding in encodings:
+        key = qutil.Bitboard.fromEncoding(encoding).canonicalKey()[0]
+        entry = book.entries.get(key)
+        if (entry is None or entry[1] < depth) and key not in pending:
+            pending[key] = encoding
+    print(f"{len(book)} positions in book, {len(pending)} to search at depth {depth}")
+
+    start_time = time.time()
+    with mp.Pool(
+        processes or mp.cpu_count(), initializer=_initWorker, initargs=(depth, searchWindow, tableSizeMB)
+    ) as pool:
+        for n, entry in enumerate(pool.imap_unordered(_searchPosition, pending.values()), start=1):
+            book.add(*entry)
+            if n % saveInterval == 0:
+                book.save()
+                print(f"{n}/{len(pending)} positions searched, {round(time.time() - start_time, 1)}s")
+
+    book.save()
+    print(f"Wrote {len(book)} positions to {book.path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or extend an opening book in tables/<name>.qob")
+    parser.add_argument("name")
+    parser.add_argument("--plies", type=int, default=1, help="add every opening position up to this many placements")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--search-window", type=int, default=256)
+    parser.add_argument("--logs", default=None, help="directory of detailed game logs to add positions from")
+    parser.add_argument("--min-empty", type=int, default=12, help="only add log positions with this many empty cells")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    buildBook(
+        args.name,
+        plies=args.plies,
+        depth=args.depth,
+        searchWindow=args.search_window,
+        logDir=args.logs,
+        minEmpty=args.min_empty,
+        processes=args.processes,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import numpy as np
+import quarto_util as qutil
+import multiprocessing as mp
+import argparse
+import os
+import pickle
+import random
+import time
+
+"""
+Endgame tablebase - exact game-theoretic values (win/draw/loss for the player to move) and best moves of
+canonical positions with at most maxEmpty empty cells.
+
+Every position with few empty cells cannot be enumerated (there are over 10^15 of them even at 4 empty cells), so the
+generator solves every canonical position reachable from a set of seed positions instead. Seeds are positions with
+exactly maxEmpty empty cells, taken from random playouts and optionally from the detailed game logs in
+experiment_results/logs, so the table covers the endgames that actually come up in our games.
+
+File layout - a 16-byte header (magic, version, maxEmpty, number of slots) followed by an open-addressing hash table
+of 64-bit words, indexed by the low bits of the canonical key:
+    bits 0-1   value + 1 (0 loss, 1 draw, 2 win)
+    bits 2-5   best move position (canonical frame)
+    bits 6-10  best move piece (canonical frame)
+    bit  11    set for every used slot
+    bits 16-63 the high 48 bits of the canonical key
+"""
+
+TABLEBASE_HEADER = np.dtype(
+    [("magic", "S4"), ("version", "<u2"), ("maxEmpty", "<u2"), ("numSlots", "<u8")]
+)
+TABLEBASE_MAGIC = b"QEGB"
+TABLEBASE_VERSION = 1
+USED_SLOT = 1 << 11
+
+
+def getTablebasePath(file_name: str):
+    return f"tables/{file_name}.qeb"
+
+
+def packEntry(key: int, value: int, position: int, piece: int):
+    return (key >> 16) << 16 | USED_SLOT | piece << 6 | position << 2 | (value + 1)
+
+
+def unpackEntry(word: int):
+    return (word & 3) - 1, (word >> 2) & 15, (word >> 6) & 31
+
+
+# Solves a position exactly - returns (value, position, piece) for the player to move, where value is 1, 0 or -1.
+# Every child is solved even after a win is found, so the table holds every canonical position reachable from the seeds
+# and not only the ones visited before a cut-off. Results are memoized by canonical key with moves in the canonical frame.
+def solve(state: qutil.Bitboard, memo: dict):
+    winningMove = qutil.firstWinningMove(state)
+    if winningMove is not None:
+        return (1, *winningMove)
+    if state.occupied == qutil.FULL_MASK:
+        return 0, 16, 16
+
+    key, transform = state.canonicalKey()
+    entry = memo.get(key)
+    if entry is not None:
+        value, position, piece = entry
+        return (value, *qutil.inverseTransformMove(transform, position, piece))
+
+    bestValue, bestMove = -2, None
+    for nextPiece in state.availablePieces() or (16,):
+        for position in state.availablePositions():
+            state.makeMove(position, nextPiece)
+            value = -solve(state, memo)[0]
+            state.unmakeMove(position, nextPiece)
+            if value > bestValue:
+                bestValue, bestMove = value, (position, nextPiece)
+
+    memo[key] = (bestValue, *qutil.transformMove(transform, *bestMove))
+    return (bestValue, *bestMove)
+
+
+# worker job - solves a chunk of seed encodings and returns the packed entries of every position it solved
+def solveSeeds(encodings):
+    memo = {}
+    for encoding in encodings:
+        solve(qutil.Bitboard.fromEncoding(encoding), memo)
+    return {key: packEntry(key, *entry) for key, entry in memo.items()}
+
+
+# Random playout from the empty board until exactly maxEmpty cells are left, handing out pieces the opponent cannot win
+# with at once where possible. Returns None if the game is won before that or the player to move can win at once, as
+# solve would not expand such a seed.
+def randomSeed(rng: random.Random, maxEmpty: int):
+    state = qutil.Bitboard()
+    state.makeFirstMove(rng.randrange(16))
+    while state.numEmpty() > maxEmpty:
+        position = rng.choice(state.availablePositions())
+        availableNextPieces = state.availablePieces()
+        state.makeMove(position, qutil.NULL_PIECE)
+        if state.isGameOver():
+            return None
+        safePieces = [piece for piece in availableNextPieces if not state.winningPositions(piece)]
+        state.unmakeMove(position, qutil.NULL_PIECE)
+        state.makeMove(position, rng.choice(safePieces or availableNextPieces))
+    if qutil.firstWinningMove(state) is not None:
+        return None
+    return state.toEncoding()
+
+
+# positions of the detailed game logs that have exactly maxEmpty empty cells
+def logSeeds(logDir: str, maxEmpty: int):
+    return [state.toEncoding() for state in qutil.loggedPositions(logDir) if state.numEmpty() == maxEmpty]
+
+
+def writeTablebase(entries: dict, maxEmpty: int, path: str):
+    numSlots = 2
+    while numSlots < 2 * len(entries):
+        numSlots *= 2
+    mask = numSlots - 1
+
+    words = np.zeros(numSlots, dtype=np.uint64)
+    slots = memoryview(words).cast("B").cast("Q")
+    for key, word in entries.items():
+        i = key & mask
+        while slots[i]:
+            i = (i + 1) & mask
+        slots[i] = word
+
+    header = np.array([(TABLEBASE_MAGIC, TABLEBASE_VERSION, maxEmpty, numSlots)], dtype=TABLEBASE_HEADER)
+    with open(path, "wb") as f:
+        f.write(header.tobytes())
+        f.write(words.tobytes())
+
+
+# Offline generator - seed chunks are solved on a process pool and the solved seeds are checkpointed with the entries.
+# An interrupted run picks up where it stopped when started again, and only solves the seeds that are not in the
+# checkpoint, so seeds added or removed by a changed log directory are handled correctly.
+def generateTablebase(
+    file_name: str,
+    maxEmpty=6,
+    numSeeds=2000,
+    logDir=None,
+    processes=None,
+    chunkSize=20,
+    seed=0,
+    checkpointInterval=10,
+):
+    rng = random.Random(seed)
+    seeds = set()
+    attempts = 0
+    while len(seeds) < numSeeds and attempts < 20 * numSeeds:
+        attempts += 1
+        encoding = randomSeed(rng, maxEmpty)
+        if encoding is not None:
+            seeds.add(encoding)
+    if logDir is not None:
+        seeds.update(logSeeds(logDir, maxEmpty))
+
+    checkpointPath = f"tables/{file_name}.checkpoint.pkl"
+    entries, solvedSeeds = {}, set()
+    if os.path.exists(checkpointPath):
+        with open(checkpointPath, "rb") as f:
+            entries, solvedSeeds = pickle.load(f)
+        print(f"Resuming from checkpoint - {len(seeds & solvedSeeds)}/{len(seeds)} seeds solved")
+
+    def saveCheckpoint():
+        with open(checkpointPath + ".tmp", "wb") as f:
+            pickle.dump((entries, solvedSeeds), f)
+        os.replace(checkpointPath + ".tmp", checkpointPath)
+
+    pending = sorted(seeds - solvedSeeds)
+    chunks = [pending[i : i + chunkSize] for i in range(0, len(pending), chunkSize)]
+    start_time = time.time()
+    with mp.Pool(processes or mp.cpu_count()) as pool:
+        results = pool.imap_unordered(_solveChunk, chunks)
+        for n, (chunk, chunkEntries) in enumerate(results, start=1):
+            entries.update(chunkEntries)
+            solvedSeeds.update(chunk)
+            if n % checkpointInterval == 0:
+                saveCheckpoint()
+                print(
+                    f"{n}/{len(chunks)} chunks, {len(entries)} positions, "
+                    f"{round(time.time() - start_time, 1)}s"
+                )
+
+    writeTablebase(entries, maxEmpty, getTablebasePath(file_name))
+    if os.path.exists(checkpointPath):
+        os.remove(checkpointPath)
+    print(f"Wrote {len(entries)} positions to {getTablebasePath(file_name)}")
+
+
+def _solveChunk(encodings):
+    return encodings, solveSeeds(encodings)
+
+
+class EndgameTablebase:
+    def __init__(self, path: str) -> None:
+        header = np.fromfile(path, dtype=TABLEBASE_HEADER, count=1)[0]
+        assert header["magic"] == TABLEBASE_MAGIC, f"{path} is not an endgame tablebase file."
+        assert header["version"] == TABLEBASE_VERSION, f"Unsupported tablebase version {header['version']}."
+
+        self.path = path
+        self.maxEmpty = int(header["maxEmpty"])
+        self.words = np.memmap(
+            path, dtype=np.uint64, mode="r", offset=TABLEBASE_HEADER.itemsize, shape=(int(header["numSlots"]),)
+        )
+        self.slots = memoryview(self.words).cast("B").cast("Q")
+        self.mask = len(self.words) - 1
+        self.probes = 0
+        self.hits = 0
+
+    @classmethod
+    def load(cls, file_name: str):
+        return cls(getTablebasePath(file_name))
+
+    def __len__(self):
+        return int(np.count_nonzero(self.words))
+
+    # mapped by path in other processes instead of copying the table
+    def __reduce__(self):
+        return (EndgameTablebase, (self.path,))
+
+    # whether positions with numEmpty empty cells can be in the table
+    def coversNumEmpty(self, numEmpty: int):
+        return numEmpty <= self.maxEmpty
+
+    def covers(self, state: qutil.Bitboard):
+        return self.coversNumEmpty(state.numEmpty())
+
+    # returns (value, position, piece) for the player to move, or None if the position is not in the table
+    def probe(self, state: qutil.Bitboard):
+        winningMove = qutil.firstWinningMove(state)
+        if winningMove is not None:
+            return (1, *winningMove)
+
+        self.probes += 1
+        key, transform = state.canonicalKey()
+        tag = key >> 16
+        slots, mask = self.slots, self.mask
+        i = key & mask
+        while True:
+            word = slots[i]
+            if not word:
+                return None
+            if word >> 16 == tag:
+                self.hits += 1
+                value, position, piece = unpackEntry(word)
+                return (value, *qutil.inverseTransformMove(transform, position, piece))
+            i = (i + 1) & mask
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate an endgame tablebase in tables/<name>.qeb")
+    parser.add_argument("name")
+    parser.add_argument("--max-empty", type=int, default=6)
+    parser.add_argument("--seeds", type=int, default=2000, help="number of random playout seed positions")
+    parser.add_argument("--logs", default=None, help="directory of detailed game logs to take seeds from")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generateTablebase(
+        args.name,
+        maxEmpty=args.max_empty,
+        numSeeds=args.seeds,
+        logDir=args.logs,
+        processes=args.processes,
+        chunkSize=args.chunk_size,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
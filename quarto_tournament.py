@@ -0,0 +1,255 @@
+from quarto import QuartoGame
+import quarto_agents as qagents
+import numpy as np
+import multiprocessing as mp
+import argparse
+import ast
+import contextlib
+import itertools
+import os
+import pickle
+import random
+import time
+
+"""
+Round-robin tournaments - every pairing of a list of agents is played in both seat orders, split into chunks of a few
+games. The chunks are handed out one at a time to a single process pool that lives for the whole tournament, so a worker
+that finishes early picks up the next chunk instead of waiting for a slow one. Each worker keeps the pickled agents and
+starts every chunk with fresh copies, so transposition tables, search trees and caches never carry over between chunks.
+
+Finished chunks are appended to experiment_results/tournaments/<name>.txt as they come in, one line per game:
+    player1,player2,chunk,result,player1cumulativeTime,player2cumulativeTime,player1numMoves,player2numMoves
+Starting a tournament again with the same name skips every chunk already in the file, so an interrupted run resumes and
+agents or games added later only play the missing chunks. writeRunFiles converts the file into the per-pairing run
+files read by experiments.create_table.
+
+Agents are pickled to the workers, so they should search in-process (pool workers cannot start pools of their own).
+"""
+
+TOURNAMENT_COLUMNS = (
+    "player1,player2,chunk,result,player1cumulativeTime,player2cumulativeTime,player1numMoves,player2numMoves"
+)
+
+
+def getTournamentPath(name: str):
+    return f"experiment_results/tournaments/{name}.txt"
+
+
+# Builds an agent from a spec string "ClassName:arg=value,..." e.g. "NegamaxAgent:depth=3,searchWindow=16"
+# A name argument renames the agent, e.g. "NegamaxAgent:depth=3,name='Control'"
+def agentFromSpec(spec: str):
+    className, _, args = spec.partition(":")
+    kwargs = dict()
+    for arg in filter(None, args.split(",")):
+        key, value = arg.split("=")
+        kwargs[key.strip()] = ast.literal_eval(value.strip())
+    name = kwargs.pop("name", None)
+    agent = getattr(qagents, className.strip())(**kwargs)
+    if name is not None:
+        agent.setName(name)
+    return agent
+
+
+# Reads the games of a tournament file - returns {(player1, player2, chunk): [game rows]}
+def readTournamentFile(path: str):
+    chunks = dict()
+    if not os.path.exists(path):
+        return chunks
+    with open(path) as f:
+        f.readline()
+        for line in f:
+            fields = line.strip().split(",")
+            if len(fields) != 8:
+                continue
+            player1, player2, chunk, result, time1, time2, moves1, moves2 = fields
+            chunks.setdefault((player1, player2, int(chunk)), []).append(
+                (int(result), float(time1), float(time2), int(moves1), int(moves2))
+            )
+    return chunks
+
+
+class Tournament:
+    def __init__(self, name: str, agents, gamesPerPairing=10, chunkSize=2, pairings=None, seed=0) -> None:
+        self.name = name
+        self.path = getTournamentPath(name)
+        self.agents = list(agents)
+        self.names = [agent.name for agent in self.agents]
+        assert len(set(self.names)) == len(self.names), f"Agent names must be unique: {self.names}"
+
+        # gamesPerPairing games are played in each seat order of every pairing (every two agents by default)
+        self.gamesPerPairing = gamesPerPairing
+        self.chunkSize = chunkSize
+        if pairings is None:
+            pairings = itertools.combinations(range(len(self.agents)), 2)
+        self.pairings = [(i, j) for pairing in pairings for i, j in (pairing, pairing[::-1])]
+        self.seed = seed
+
+        # every chunk as (player1 index, player2 index, chunk index, number of games), and the finished chunks
+        self.schedule = [
+            (i, j, chunk, min(chunkSize, gamesPerPairing - start))
+            for chunk, start in enumerate(range(0, gamesPerPairing, chunkSize))
+            for i, j in self.pairings
+        ]
+        self.completed = dict()
+
+    # finished chunks of the file - chunks cut short by an interrupted write are played again
+    def loadCompleted(self):
+        sizes = {(self.names[i], self.names[j], chunk): numGames for i, j, chunk, numGames in self.schedule}
+        self.completed = {
+            key: games
+            for key, games in readTournamentFile(self.path).items()
+            if key not in sizes or len(games) == sizes[key]
+        }
+        return self.completed
+
+    def pendingChunks(self):
+        return [job for job in self.schedule if (self.names[job[0]], self.names[job[1]], job[2]) not in self.completed]
+
+    # rewrites the file without any partial chunk, so appended chunks stay complete
+    def rewriteFile(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            f.write(TOURNAMENT_COLUMNS + "\n")
+            for key, games in self.completed.items():
+                f.write(formatChunk(*key, games))
+        os.replace(self.path + ".tmp", self.path)
+
+    def run(self, processes=None):
+        self.loadCompleted()
+        pending = self.pendingChunks()
+        print(
+            f"{self.name}: {len(self.agents)} agents, {len(self.pairings)} seatings, "
+            f"{len(self.schedule) - len(pending)}/{len(self.schedule)} chunks done"
+        )
+        if not pending:
+            return self.standings()
+
+        self.rewriteFile()
+        jobs = [(i, j, chunk, numGames, self.chunkSeed(i, j, chunk)) for i, j, chunk, numGames in pending]
+        start_time = time.time()
+        processes = min(processes or mp.cpu_count(), len(jobs))
+        with open(self.path, "a") as f, mp.Pool(processes, initializer=_initWorker, initargs=(self.agents,)) as pool:
+            for n, (i, j, chunk, games) in enumerate(pool.imap_unordered(_playChunk, jobs), start=1):
+                key = (self.names[i], self.names[j], chunk)
+                self.completed[key] = games
+                f.write(formatChunk(*key, games))
+                f.flush()
+                if n % max(1, len(jobs) // 20) == 0 or n == len(jobs):
+                    print(f"{n}/{len(jobs)} chunks played, {round(time.time() - start_time, 1)}s")
+
+        return self.standings()
+
+    # Chunk seeds only depend on the tournament seed and the chunk, and every chunk starts from freshly unpickled agents,
+    # so a resumed run plays the same games - as long as no agent depends on timing (time limits, island migration)
+    def chunkSeed(self, i, j, chunk):
+        names = [int.from_bytes(name.encode(), "little") % 2**32 for name in (self.names[i], self.names[j])]
+        return int(np.random.SeedSequence([self.seed, *names, chunk]).generate_state(1)[0])
+
+    # {agent name: [wins, losses, draws, invalid moves, games played, total move time, moves]}
+    def standings(self):
+        table = {name: [0, 0, 0, 0, 0, 0.0, 0] for name in self.names}
+        for (player1, player2, _), games in self.completed.items():
+            if player1 not in table or player2 not in table:
+                continue
+            for result, time1, time2, moves1, moves2 in games:
+                for player, identifier, moveTime, moves in ((player1, 1, time1, moves1), (player2, 2, time2, moves2)):
+                    stats = table[player]
+                    stats[0] += result == identifier
+                    stats[1] += result == 3 - identifier
+                    stats[2] += result == 0
+                    stats[3] += result == -identifier
+                    stats[4] += 1
+                    stats[5] += moveTime
+                    stats[6] += moves
+        return table
+
+    def showStandings(self):
+        table = self.standings()
+        print(f"\n{'agent':<32}{'wins':>7}{'losses':>8}{'draws':>7}{'invalid':>9}{'games':>7}{'avg move time':>15}")
+        for name, (wins, losses, draws, invalid, games, moveTime, moves) in sorted(
+            table.items(), key=lambda item: item[1][0] - item[1][1], reverse=True
+        ):
+            avgMoveTime = round(moveTime / moves, 4) if moves else 0
+            print(f"{name:<32}{wins:>7}{losses:>8}{draws:>7}{invalid:>9}{games:>7}{avgMoveTime:>15}")
+
+    # one run file per seating in the format of experiments.mpBatchRun, for experiments.create_table
+    def writeRunFiles(self, directory="experiment_results/final"):
+        os.makedirs(directory, exist_ok=True)
+        for i, j in self.pairings:
+            player1, player2 = self.names[i], self.names[j]
+            games = [
+                game
+                for chunk in range(len(range(0, self.gamesPerPairing, self.chunkSize)))
+                for game in self.completed.get((player1, player2, chunk), [])
+            ]
+            if not games:
+                continue
+            with open(f"{directory}/{self.name} {player1}_{player2}.txt", "w") as f:
+                f.write(f"{player1},{player2},{len(games)}\n")
+                f.write("result,player1cumulativeTime,player2cumulativeTime,player1numMoves,player2numMoves\n")
+                for result, time1, time2, moves1, moves2 in games:
+                    f.write(f"{result},{round(time1, 4)},{round(time2, 4)},{moves1},{moves2}\n")
+
+
+def formatChunk(player1, player2, chunk, games):
+    return "".join(
+        f"{player1},{player2},{chunk},{result},{round(time1, 4)},{round(time2, 4)},{moves1},{moves2}\n"
+        for result, time1, time2, moves1, moves2 in games
+    )
+
+
+_agentData = None
+
+
+# each worker keeps the agents pickled as they were handed to the tournament
+def _initWorker(agents):
+    global _agentData
+    _agentData = [pickle.dumps(agent) for agent in agents]
+
+
+# worker job - plays one chunk of games with fresh copies of both agents and returns their results and move times
+def _playChunk(job):
+    i, j, chunk, numGames, seed = job
+    np.random.seed(seed)
+    random.seed(seed)
+    game = QuartoGame(pickle.loads(_agentData[i]), pickle.loads(_agentData[j]), log_stats=True)
+    games = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(numGames):
+            game.resetGame()
+            game.resetStats()
+            result = game.play()
+            games.append(
+                (result, game.agent1_cumulative_time, game.agent2_cumulative_time, game.numMoves1, game.numMoves2)
+            )
+    return i, j, chunk, games
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run or resume a round-robin tournament between agents")
+    parser.add_argument("name")
+    parser.add_argument(
+        "agents", nargs="+", help='agent specs "ClassName:arg=value,..." e.g. "NegamaxAgent:depth=3,searchWindow=16"'
+    )
+    parser.add_argument("--games", type=int, default=10, help="games per pairing in each seat order")
+    parser.add_argument("--chunk-size", type=int, default=2)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--run-files", default=None, help="also write per-pairing run files to this directory")
+    args = parser.parse_args()
+
+    tournament = Tournament(
+        args.name,
+        [agentFromSpec(spec) for spec in args.agents],
+        gamesPerPairing=args.games,
+        chunkSize=args.chunk_size,
+        seed=args.seed,
+    )
+    tournament.run(args.processes)
+    tournament.showStandings()
+    if args.run_files is not None:
+        tournament.writeRunFiles(args.run_files)
+
+
+if __name__ == "__main__":
+    main()
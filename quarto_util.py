@@ -1,5 +1,10 @@
 import numpy as np
 import pandas as pd
+import random
+import itertools
+import os
+from multiprocessing import shared_memory
+from collections import OrderedDict
 
 
 def convertIntMoveToStr(move: int):
@@ -49,6 +54,519 @@ def getLinearCoords(row, col):
     return 4 * row + col
 
 
+# Bitboard representation of a game state
+# The 16 cells are packed row-wise into a 64-bit integer with 4 bits per cell (cell i occupies bits 4i to 4i+3).
+# Since piece 0 is indistinguishable from an empty cell in that integer, a 16-bit occupancy mask marks the filled cells.
+# A second 16-bit mask holds the pieces that are still available to be given to the opponent.
+FULL_MASK = 0xFFFF
+NULL_PIECE = 16
+
+# the 10 winning lines as tuples of linear cell indices - 4 rows, 4 columns, obtuse and acute diagonals
+LINES = (
+    (0, 1, 2, 3),
+    (4, 5, 6, 7),
+    (8, 9, 10, 11),
+    (12, 13, 14, 15),
+    (0, 4, 8, 12),
+    (1, 5, 9, 13),
+    (2, 6, 10, 14),
+    (3, 7, 11, 15),
+    (0, 5, 10, 15),
+    (3, 6, 9, 12),
+)
+LINE_MASKS = tuple(sum(1 << cell for cell in line) for line in LINES)
+CELL_LINES = tuple(tuple(l for l in range(len(LINES)) if cell in LINES[l]) for cell in range(16))
+
+# set bit indices of every byte, used to iterate over 16-bit masks without a python loop over all bits
+_BYTE_INDICES = tuple(tuple(i for i in range(8) if byte >> i & 1) for byte in range(256))
+_HIGH_BYTE_INDICES = tuple(tuple(i + 8 for i in indices) for indices in _BYTE_INDICES)
+
+
+def bitIndices(mask: int):
+    return _BYTE_INDICES[mask & 255] + _HIGH_BYTE_INDICES[mask >> 8]
+
+
+# Per-line state for the 10 winning lines, updated incrementally as pieces are placed
+# Each line is packed into one integer: bits 0-3 hold the running AND of its pieces, bits 4-7 the running NOR
+# (the AND of the negated pieces) and bits 8-10 how many of its cells are filled. An empty line is 0xFF.
+# Placing a piece only touches the 2-3 lines through its cell, so win checks and three-line counts are O(1).
+EMPTY_LINE = 0xFF
+
+
+class LineTracker:
+    __slots__ = ("lines", "numThreeLines", "numWinningLines", "history")
+
+    def __init__(self) -> None:
+        self.lines = [EMPTY_LINE] * len(LINES)
+        self.numThreeLines = 0  # lines of three pieces sharing at least one attribute
+        self.numWinningLines = 0  # full lines sharing at least one attribute
+        self.history = []
+
+    @classmethod
+    def fromCells(cls, cells: int, occupied: int):
+        tracker = cls()
+        for position in bitIndices(occupied):
+            tracker.place(position, (cells >> 4 * position) & 15)
+        tracker.history.clear()
+        return tracker
+
+    def copy(self):
+        tracker = LineTracker()
+        tracker.lines = self.lines.copy()
+        tracker.numThreeLines = self.numThreeLines
+        tracker.numWinningLines = self.numWinningLines
+        tracker.history = self.history.copy()
+        return tracker
+
+    def place(self, position: int, piece: int):
+        # the previous line list is kept as is for undo - copying 10 integers is cheaper than saving selectively
+        self.history.append((self.lines, self.numThreeLines, self.numWinningLines))
+        self.lines = lines = self.lines.copy()
+        for l in CELL_LINES[position]:
+            line = lines[l]
+            count = (line >> 8) + 1
+            bitwiseAnd = line & piece
+            bitwiseNot = (line >> 4) & ~piece & 15
+            lines[l] = bitwiseAnd | bitwiseNot << 4 | count << 8
+
+            if count == 3:
+                if bitwiseAnd | bitwiseNot:
+                    self.numThreeLines += 1
+            elif count == 4:
+                if (line | line >> 4) & 15:
+                    self.numThreeLines -= 1
+                if bitwiseAnd | bitwiseNot:
+                    self.numWinningLines += 1
+
+    # reverts the last placement
+    def undo(self):
+        self.lines, self.numThreeLines, self.numWinningLines = self.history.pop()
+
+    # attributes shared by every piece on a line (0 if there are none)
+    def sharedAttributes(self, l: int):
+        line = self.lines[l]
+        return (line | line >> 4) & 15
+
+    def lineCount(self, l: int):
+        return self.lines[l] >> 8
+
+    # only the lines through the last placed cell can become winning lines
+    def isWinAt(self, position: int):
+        lines = self.lines
+        for l in CELL_LINES[position]:
+            line = lines[l]
+            if line >> 8 == 4 and (line | line >> 4) & 15:
+                return True
+        return False
+
+    def isWin(self):
+        return self.numWinningLines > 0
+
+    def countThreeLines(self):
+        return self.numThreeLines
+
+
+# Zobrist hashing - one random 64-bit key per (cell, piece) pair and per current piece (including the null piece)
+# The generator is seeded so that keys are identical across processes and runs, which stored tables rely on.
+_zobristGenerator = random.Random(20230816)
+ZOBRIST_CELLS = tuple(
+    tuple(_zobristGenerator.getrandbits(64) for piece in range(16)) for position in range(16)
+)
+ZOBRIST_CURRENT = tuple(_zobristGenerator.getrandbits(64) for piece in range(17))
+
+
+def zobristKey(cells: int, occupied: int, currentPiece: int):
+    key = ZOBRIST_CURRENT[currentPiece]
+    for position in bitIndices(occupied):
+        key ^= ZOBRIST_CELLS[position][(cells >> 4 * position) & 15]
+    return key
+
+
+# Accessors shared by Bitboard and GameState, which both hold the cells (4 bits per cell), the occupied cell mask, the
+# available piece mask and the current piece
+class _BoardMasks:
+    __slots__ = ()
+
+    def toEncoding(self):
+        encoding = ""
+        for position in range(16):
+            if self.occupied >> position & 1:
+                encoding += convertIntMoveToStr((self.cells >> 4 * position) & 15)
+            else:
+                encoding += "16"
+        return encoding + convertIntMoveToStr(self.currentPiece)
+
+    def getPiece(self, position: int):
+        if self.occupied >> position & 1:
+            return (self.cells >> 4 * position) & 15
+        return NULL_PIECE
+
+    def availablePositions(self):
+        return bitIndices(~self.occupied & FULL_MASK)
+
+    def availablePieces(self):
+        return bitIndices(self.pieces)
+
+    def numEmpty(self):
+        return 16 - self.occupied.bit_count()
+
+
+class Bitboard(_BoardMasks):
+    __slots__ = ("cells", "occupied", "pieces", "currentPiece", "lines", "key")
+
+    def __init__(
+        self, cells=0, occupied=0, pieces=FULL_MASK, currentPiece=NULL_PIECE, lines=None, key=None
+    ) -> None:
+        self.cells = cells
+        self.occupied = occupied
+        self.pieces = pieces
+        self.currentPiece = currentPiece
+        self.lines = lines if lines is not None else LineTracker.fromCells(cells, occupied)
+        self.key = key if key is not None else zobristKey(cells, occupied, currentPiece)
+
+    @classmethod
+    def fromBoard(cls, boardArray, currentPiece):
+        cells, occupied, pieces = 0, 0, FULL_MASK
+        for i in range(4):
+            for j in range(4):
+                piece = int(boardArray[i][j])
+                if piece != NULL_PIECE:
+                    position = 4 * i + j
+                    cells |= piece << 4 * position
+                    occupied |= 1 << position
+                    pieces &= ~(1 << piece)
+        currentPiece = int(currentPiece)
+        if currentPiece != NULL_PIECE:
+            pieces &= ~(1 << currentPiece)
+        return cls(cells, occupied, pieces, currentPiece)
+
+    @classmethod
+    def fromEncoding(cls, encoding: str):
+        cells, occupied, pieces = 0, 0, FULL_MASK
+        for position in range(16):
+            piece = int(encoding[2 * position : 2 * position + 2])
+            if piece != NULL_PIECE:
+                cells |= piece << 4 * position
+                occupied |= 1 << position
+                pieces &= ~(1 << piece)
+        currentPiece = int(encoding[-2:])
+        if currentPiece != NULL_PIECE:
+            pieces &= ~(1 << currentPiece)
+        return cls(cells, occupied, pieces, currentPiece)
+
+    def toBoard(self):
+        board = np.full((4, 4), NULL_PIECE)
+        for position in bitIndices(self.occupied):
+            board[position // 4][position % 4] = (self.cells >> 4 * position) & 15
+        return board
+
+    # flat array of the 16 cells in cell order with 16 for empty cells, as taken by evaluateBoards
+    def toArray(self):
+        array = np.full(16, NULL_PIECE, dtype=np.int8)
+        for position in bitIndices(self.occupied):
+            array[position] = (self.cells >> 4 * position) & 15
+        return array
+
+    def copy(self):
+        return Bitboard(
+            self.cells, self.occupied, self.pieces, self.currentPiece, self.lines.copy(), self.key
+        )
+
+    # hands out the first piece on the empty board - the key follows the current piece like in makeMove
+    def makeFirstMove(self, piece: int):
+        self.key ^= ZOBRIST_CURRENT[self.currentPiece] ^ ZOBRIST_CURRENT[piece]
+        self.pieces &= ~(1 << piece)
+        self.currentPiece = piece
+
+    # places the current piece at position and hands nextPiece to the opponent (16 when no pieces are left)
+    def makeMove(self, position: int, nextPiece: int):
+        self.lines.place(position, self.currentPiece)
+        self.key ^= (
+            ZOBRIST_CELLS[position][self.currentPiece]
+            ^ ZOBRIST_CURRENT[self.currentPiece]
+            ^ ZOBRIST_CURRENT[nextPiece]
+        )
+        self.cells |= self.currentPiece << 4 * position
+        self.occupied |= 1 << position
+        if nextPiece != NULL_PIECE:
+            self.pieces &= ~(1 << nextPiece)
+        self.currentPiece = nextPiece
+
+    # exact inverse of makeMove - the placed piece becomes the current piece again
+    def unmakeMove(self, position: int, nextPiece: int):
+        self.lines.undo()
+        shift = 4 * position
+        self.currentPiece = (self.cells >> shift) & 15
+        self.key ^= (
+            ZOBRIST_CELLS[position][self.currentPiece]
+            ^ ZOBRIST_CURRENT[self.currentPiece]
+            ^ ZOBRIST_CURRENT[nextPiece]
+        )
+        self.cells &= ~(15 << shift)
+        self.occupied &= ~(1 << position)
+        if nextPiece != NULL_PIECE:
+            self.pieces |= 1 << nextPiece
+
+    def isWinAt(self, position: int):
+        return self.lines.isWinAt(position)
+
+    def isGameOver(self):
+        return self.lines.isWin()
+
+    # counts how many lines of three pieces share an identical property
+    def countThreeLines(self):
+        return self.lines.numThreeLines
+
+    # mask of the empty cells where placing piece completes a winning line
+    def winningPositions(self, piece: int):
+        mask = 0
+        lines = self.lines.lines
+        for l in range(len(LINES)):
+            line = lines[l]
+            if line >> 8 == 3 and ((line & piece) | (line >> 4 & ~piece)) & 15:
+                mask |= LINE_MASKS[l]
+        return mask & ~self.occupied
+
+    def canonicalKey(self):
+        return canonicalize(self.cells, self.occupied, self.currentPiece)
+
+    def toState(self):
+        return GameState(self.cells, self.occupied, self.pieces, self.currentPiece)
+
+
+# Immutable game state handed to agents - the cell integer and piece masks of a Bitboard without its line tracker and
+# key, so it is cheap to create and to compare. play returns the child state in O(1) and states are hashable, so they
+# can be shared between agents and used as dictionary keys. Searches that need win checks build a Bitboard from it.
+class GameState(_BoardMasks):
+    __slots__ = ("cells", "occupied", "pieces", "currentPiece")
+
+    def __init__(self, cells=0, occupied=0, pieces=FULL_MASK, currentPiece=NULL_PIECE) -> None:
+        object.__setattr__(self, "cells", cells)
+        object.__setattr__(self, "occupied", occupied)
+        object.__setattr__(self, "pieces", pieces)
+        object.__setattr__(self, "currentPiece", currentPiece)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GameState is immutable - play returns a new state")
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, GameState)
+            and self.cells == other.cells
+            and self.occupied == other.occupied
+            and self.pieces == other.pieces
+            and self.currentPiece == other.currentPiece
+        )
+
+    def __hash__(self):
+        return hash((self.cells, self.occupied, self.pieces, self.currentPiece))
+
+    def __repr__(self):
+        return f"GameState({self.toEncoding()})"
+
+    # immutable objects are pickled by their fields
+    def __reduce__(self):
+        return (GameState, (self.cells, self.occupied, self.pieces, self.currentPiece))
+
+    @classmethod
+    def fromEncoding(cls, encoding: str):
+        return Bitboard.fromEncoding(encoding).toState()
+
+    def toBitboard(self):
+        return Bitboard(self.cells, self.occupied, self.pieces, self.currentPiece)
+
+    # the (encoding, available pieces, available positions) tuple that agents were given before GameState
+    def toTuple(self):
+        return (self.toEncoding(), set(self.availablePieces()), set(self.availablePositions()))
+
+    # the state after placing the current piece at position and handing nextPiece to the opponent
+    def play(self, position: int, nextPiece: int):
+        if self.currentPiece == NULL_PIECE:
+            raise ValueError("There is no piece to place - the first piece has not been handed out")
+        if position not in range(16) or self.occupied >> position & 1:
+            raise ValueError(f"Cell {position} is not available")
+        if nextPiece == NULL_PIECE:
+            if self.pieces:
+                raise ValueError("A next piece has to be handed out while pieces are left")
+        elif nextPiece not in range(16) or not self.pieces >> nextPiece & 1:
+            raise ValueError(f"Piece {nextPiece} is not available")
+        return GameState(
+            self.cells | self.currentPiece << 4 * position,
+            self.occupied | 1 << position,
+            self.pieces & ~(1 << nextPiece) if nextPiece != NULL_PIECE else self.pieces,
+            nextPiece,
+        )
+
+
+# Agents that set usesGameState are given the GameState itself, older agents the tuple they were written for
+def agentGameState(agent, state: GameState):
+    return state if getattr(agent, "usesGameState", False) else state.toTuple()
+
+
+# (position, nextPiece) winning at once with the current piece - the lowest winning cell and the lowest available
+# piece - or None when the current piece cannot complete a line
+def firstWinningMove(state: Bitboard):
+    winningPositions = state.winningPositions(state.currentPiece)
+    if not winningPositions:
+        return None
+    availableNextPieces = state.availablePieces()
+    return (winningPositions & -winningPositions).bit_length() - 1, (
+        availableNextPieces[0] if availableNextPieces else NULL_PIECE
+    )
+
+
+# Finds the opponent's reply between two of our moves - replays ourMove (position, nextPiece) on previousState and
+# returns the (position, piece) the opponent played to reach state, or None if state does not follow from it
+def opponentReply(previousState: Bitboard, ourMove, state: Bitboard):
+    if state.numEmpty() != previousState.numEmpty() - 2:
+        return None
+    replayed = previousState.copy()
+    replayed.makeMove(*ourMove)
+    opponentPosition = (state.occupied & ~replayed.occupied).bit_length() - 1
+    if opponentPosition < 0:
+        return None
+    replayed.makeMove(opponentPosition, state.currentPiece)
+    if replayed.toEncoding() != state.toEncoding():
+        return None
+    return opponentPosition, state.currentPiece
+
+
+# Symmetries of a position
+# The board has 32 line-preserving cell permutations: the same permutation r applied to the rows and either r or its
+# mirror applied to the columns, where r is one of the 8 row permutations that commute with mirroring (this includes
+# the inner/outer swap), each optionally transposed. Pieces can additionally be mapped by any of the 24 attribute
+# permutations combined with any of the 16 attribute complements without changing which lines share an attribute.
+def _createBoardSymmetries():
+    mirror = (3, 2, 1, 0)
+    rowPermutations = [
+        r for r in itertools.permutations(range(4)) if all(r[3 - i] == 3 - r[i] for i in range(4))
+    ]
+    symmetries = []
+    for r in rowPermutations:
+        for s in (r, tuple(mirror[i] for i in r)):
+            for transpose in (False, True):
+                symmetry = []
+                for cell in range(16):
+                    row, col = r[cell // 4], s[cell % 4]
+                    symmetry.append(4 * col + row if transpose else 4 * row + col)
+                symmetries.append(tuple(symmetry))
+
+    lineSet = {frozenset(line) for line in LINES}
+    for symmetry in symmetries:
+        assert {frozenset(symmetry[cell] for cell in line) for line in LINES} == lineSet
+    assert len(set(symmetries)) == 32
+    return tuple(symmetries)
+
+
+BOARD_SYMMETRIES = _createBoardSymmetries()
+INVERSE_BOARD_SYMMETRIES = tuple(
+    tuple(symmetry.index(cell) for cell in range(16)) for symmetry in BOARD_SYMMETRIES
+)
+
+# ATTRIBUTE_ORDERS[k] lists the attributes that are moved to bits 3, 2, 1 and 0 by piece permutation k
+ATTRIBUTE_ORDERS = tuple(itertools.permutations(range(4)))
+_ATTRIBUTE_ORDER_INDEX = {order: k for k, order in enumerate(ATTRIBUTE_ORDERS)}
+PIECE_PERMUTATIONS = tuple(
+    tuple(sum(((piece >> a) & 1) << (3 - i) for i, a in enumerate(order)) for piece in range(16)) + (NULL_PIECE,)
+    for order in ATTRIBUTE_ORDERS
+)
+INVERSE_PIECE_PERMUTATIONS = tuple(
+    tuple(permutation.index(piece) for piece in range(16)) + (NULL_PIECE,)
+    for permutation in PIECE_PERMUTATIONS
+)
+
+# per occupancy mask - the smallest transformed mask and, for every symmetry reaching it, the original cells in the order
+# of the transformed board. Only masks met during play are computed, and each one only once per process.
+_canonicalOccupancies = {}
+
+
+def _canonicalOccupancy(occupied: int):
+    result = _canonicalOccupancies.get(occupied)
+    if result is None:
+        cells = bitIndices(occupied)
+        transformed = [
+            (sum(1 << symmetry[cell] for cell in cells), g) for g, symmetry in enumerate(BOARD_SYMMETRIES)
+        ]
+        minOccupied = min(transformed)[0]
+        candidates = tuple(
+            (g, tuple(INVERSE_BOARD_SYMMETRIES[g][cell] for cell in bitIndices(minOccupied)))
+            for transformedOccupied, g in transformed
+            if transformedOccupied == minOccupied
+        )
+        result = _canonicalOccupancies[occupied] = (minOccupied, candidates)
+    return result
+
+
+# _COLUMN_MASKS[n] selects the lowest bit of each of n nibbles
+_COLUMN_MASKS = tuple(int("1" * n, 16) if n else 0 for n in range(18))
+
+
+def _mix64(x: int):
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return x ^ (x >> 31)
+
+
+# Maps a position to a 64-bit key shared by its whole equivalence class and returns it with the transform
+# (board symmetry, piece complement, piece permutation) taking the position to its canonical representative.
+# The available pieces are implied by the board and the current piece, so they do not need to be passed in.
+# The representative is the smallest (occupancy mask, pieces in cell order followed by the current piece).
+# Only the symmetries giving the smallest occupancy mask are compared. For each of them the complement has to map the
+# first piece to 0, and sorting the attribute columns of the sequence gives the smallest permutation directly,
+# so none of the 384 piece transforms need to be enumerated.
+def canonicalize(cells: int, occupied: int, currentPiece: int):
+    minOccupied, candidates = _canonicalOccupancy(occupied)
+    hasCurrent = currentPiece != NULL_PIECE
+
+    best = None
+    for g, order in candidates:
+        # pack the pieces in canonical cell order into one integer, first piece in the most significant nibble
+        sequence = 0
+        for cell in order:
+            sequence = sequence << 4 | (cells >> 4 * cell) & 15
+        length = len(order)
+        if hasCurrent:
+            sequence = sequence << 4 | currentPiece
+            length += 1
+        if length == 0:
+            return _mix64(0), (0, 0, 0)
+
+        columnMask = _COLUMN_MASKS[length]
+        complement = sequence >> 4 * (length - 1)
+        sequence ^= complement * columnMask
+
+        columns = [(sequence >> a) & columnMask for a in range(4)]
+        attributeOrder = sorted(range(4), key=columns.__getitem__)
+        canonical = (
+            columns[attributeOrder[0]] << 3
+            | columns[attributeOrder[1]] << 2
+            | columns[attributeOrder[2]] << 1
+            | columns[attributeOrder[3]]
+        )
+        if best is None or canonical < best[0]:
+            best = (canonical, g, complement, _ATTRIBUTE_ORDER_INDEX[tuple(attributeOrder)])
+
+    canonical, g, complement, permutation = best
+    key = _mix64(canonical & 0xFFFFFFFFFFFFFFFF ^ _mix64(canonical >> 64 | minOccupied << 8 | hasCurrent << 24))
+    return key, (g, complement, permutation)
+
+
+# maps a move of the original position to the canonical position
+def transformMove(transform, position: int, piece: int):
+    g, complement, permutation = transform
+    if piece != NULL_PIECE:
+        piece = PIECE_PERMUTATIONS[permutation][piece ^ complement]
+    return BOARD_SYMMETRIES[g][position], piece
+
+
+# maps a move of the canonical position (e.g. a stored best move) back to the original position
+def inverseTransformMove(transform, position: int, piece: int):
+    g, complement, permutation = transform
+    if piece != NULL_PIECE:
+        piece = INVERSE_PIECE_PERMUTATIONS[permutation][piece] ^ complement
+    return INVERSE_BOARD_SYMMETRIES[g][position], piece
+
+
 # Determines if there is a matching column of bits for a list of integers between 0 (inclusive) and 16 (exclusive)
 def matchingPropertyExists(line):
     # bitwiseAnd - checks if there is a column of 1s by getting the conjunction
@@ -63,73 +581,455 @@ def matchingPropertyExists(line):
     return result > 0
 
 
-def isGameOver(board):
-    for i in range(4):
-        # check horizontal lines
-        if np.count_nonzero(board[i] == 16) == 0:
-            if matchingPropertyExists(board[i]):
-                return True
+# cell indices of every line, used to gather the lines of many boards at once
+LINE_INDICES = np.array(LINES)
 
-        # check vertical lines
-        if np.count_nonzero(board[:, i] == 16) == 0:
-            if matchingPropertyExists(board[:, i]):
-                return True
 
-    # check obtuse diagonal line
-    if np.count_nonzero(np.diag(board) == 16) == 0:
-        if matchingPropertyExists(np.diag(board)):
-            return True
+# Evaluates a batch of boards in a few vector operations - boards is an (N, 16) integer array in cell order with 16 for
+# empty cells. Returns (wins, threeLines): whether each board has a full line with a common property and how many of
+# its lines hold exactly three pieces sharing a property, the same counts LineTracker keeps for a single board.
+def evaluateBoards(boards):
+    lines = np.asarray(boards, dtype=np.int8)[:, LINE_INDICES]
+    empty = lines == NULL_PIECE
+    # empty cells are 15 in both masks so that they do not affect the conjunction
+    andMask = np.bitwise_and.reduce(np.where(empty, 15, lines), axis=2)
+    norMask = np.bitwise_and.reduce(np.where(empty, 15, ~lines & 15), axis=2)
+    common = (andMask | norMask) != 0
+    count = 4 - empty.sum(axis=2)
+    wins = ((count == 4) & common).any(axis=1)
+    threeLines = ((count == 3) & common).sum(axis=1)
+    return wins, threeLines
 
-    # check acute diagonal line:
-    if np.count_nonzero(np.diag(board[::-1]) == 16) == 0:
-        if matchingPropertyExists(np.diag(board[::-1])):
-            return True
 
-    # no winning line found
-    return False
+# lines through every cell, padded to three with the unused line column 10
+CELL_LINE_INDICES = np.array([cellLines + (10,) * (3 - len(cellLines)) for cellLines in CELL_LINES])
 
 
-def isGameOverEncoding(encoding):
-    board = [int(encoding[i] + encoding[i + 1]) for i in range(0, len(encoding) - 2, 2)]
+# Plays N move paths from the same root in lock step - positions and placedPieces are (N, moves) arrays of the cells
+# played and the pieces placed there. The packed line state of LineTracker is kept for all paths in an (N, 11) array and
+# only the lines through the placed cells are updated at each ply.
+# Returns (winPly, threeLines): the first ply at which each path completes a line (-1 if it never does) and the number
+# of three-in-a-line lines on each leaf board.
+def simulatePaths(rootState: Bitboard, positions, placedPieces):
+    numPaths, numMoves = positions.shape
+    lines = np.tile(np.array(rootState.lines.lines + [EMPTY_LINE], dtype=np.int32), (numPaths, 1))
+    rows = np.arange(numPaths)[:, None]
+    winPly = np.full(numPaths, -1, dtype=np.int64)
 
-    for i in range(4):
-        # check horizontal lines
-        horizontal = board[4 * i : 4 * (i + 1)]
-        if 16 not in horizontal:
-            if matchingPropertyExists(horizontal):
-                return True
+    for t in range(numMoves):
+        cellLines = CELL_LINE_INDICES[positions[:, t]]
+        piece = placedPieces[:, t, None].astype(np.int32)
+        line = lines[rows, cellLines]
+        line = (line & piece) | (line & (~piece & 15) << 4) | ((line >> 8) + 1) << 8
+        lines[rows, cellLines] = line
 
-        # check vertical lines
-        vertical = board[i : len(board) : 4]
-        if 16 not in vertical:
-            if matchingPropertyExists(vertical):
-                return True
+        wins = ((line >> 8 == 4) & ((line | line >> 4) & 15 != 0) & (cellLines != 10)).any(axis=1)
+        winPly[wins & (winPly == -1)] = t
+        # the leaf heuristic only matters for paths that are never won
+        if (winPly != -1).all():
+            break
 
-    # check obtuse diagonal line
-    diagonal1 = board[0 : len(board) : 5]
-    if 16 not in diagonal1:
-        if matchingPropertyExists(diagonal1):
-            return True
+    lines = lines[:, :10]
+    threeLines = ((lines >> 8 == 3) & ((lines | lines >> 4) & 15 != 0)).sum(axis=1)
+    return winPly, threeLines
 
-    # check acute diagonal line:
-    diagonal2 = board[3:-1:3]
-    if 16 not in diagonal2:
-        if matchingPropertyExists(diagonal2):
-            return True
 
-    return False
+# Plays numPlayouts uniformly random games from the state to the end in lock step - every playout fills the empty cells
+# in a random order with the current piece followed by the available pieces in a random order.
+# Returns the result of every playout for the player to move (1 win, 0 draw, -1 loss).
+def randomPlayouts(state: Bitboard, numPlayouts: int):
+    availablePositions = np.array(state.availablePositions(), dtype=np.int8)
+    availablePieces = np.array(state.availablePieces(), dtype=np.int8)
+    positions = availablePositions[np.argsort(np.random.random((numPlayouts, len(availablePositions))), axis=1)]
+    placedPieces = np.empty_like(positions)
+    placedPieces[:, 0] = state.currentPiece
+    pieces = availablePieces[np.argsort(np.random.random((numPlayouts, len(availablePieces))), axis=1)]
+    placedPieces[:, 1:] = pieces[:, : positions.shape[1] - 1]
+
+    winPly, _ = simulatePaths(state, positions, placedPieces)
+    return np.where(winPly == -1, 0, 1 - 2 * (winPly % 2))
+
+
+def isGameOver(board):
+    return Bitboard.fromBoard(board, NULL_PIECE).isGameOver()
+
+
+def isGameOverEncoding(encoding):
+    return Bitboard.fromEncoding(encoding).isGameOver()
 
 
 # transposition table functions
-def createTable(file_name: str):
-    df = pd.DataFrame(columns=["encoding", "evaluation", "movePos", "movePiece"])
+# Entries are 16 bytes - the 64-bit position key and a 64-bit data word packing
+# value (bits 0-15, offset by 2^15), depth (16-23), bound flag (24-31), best move position (32-39),
+# best move piece (40-47) and the search generation that stored it (48-55).
+TABLE_ENTRY = np.dtype([("key", "<u8"), ("data", "<u8")])
+EMPTY, EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2, 3
+DEFAULT_TABLE_SIZE_MB = 16
+
+
+def packTableData(value, depth, flag, position, piece, generation):
+    return (
+        (value + 32768)
+        | depth << 16
+        | flag << 24
+        | position << 32
+        | piece << 40
+        | generation << 48
+    )
+
+
+def unpackTableData(data: int):
+    return (
+        (data & 0xFFFF) - 32768,
+        (data >> 16) & 255,
+        (data >> 24) & 255,
+        (data >> 32) & 255,
+        (data >> 40) & 255,
+    )
+
+
+# the largest power of two number of entries that fits in sizeMB
+def tableEntriesForSize(sizeMB):
+    numEntries = 2
+    while 2 * numEntries * TABLE_ENTRY.itemsize <= sizeMB * 2**20:
+        numEntries *= 2
+    return numEntries
+
+
+# Fixed-capacity, hash-indexed transposition table
+# Entries live in a preallocated numpy array split into buckets of two slots - the first slot keeps the deepest
+# entry of the current search (depth-preferred), the second is always replaced. Probes and stores are O(1).
+class TranspositionTable:
+    def __init__(self, sizeMB=DEFAULT_TABLE_SIZE_MB, entries=None) -> None:
+        if entries is None:
+            entries = np.zeros(tableEntriesForSize(sizeMB), dtype=TABLE_ENTRY)
+        assert len(entries) >= 2 and len(entries) & (len(entries) - 1) == 0, "Table size must be a power of two."
+
+        self.entries = entries
+        # entry i is read through a flat memoryview of 64-bit words (key at 2i, data at 2i+1) which indexes to plain
+        # python integers - much cheaper than creating numpy scalars on every probe
+        self.words = memoryview(entries.view(np.uint64)).cast("B").cast("Q")
+        self.bucketMask = len(entries) // 2 - 1
+        self.generation = 0
+        self.path = None  # set when the table is mapped from a file
+        self.fallback = None  # read-only table probed on a miss, e.g. a persistent table file
+        self.resetStats()
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def sizeMB(self):
+        return self.entries.nbytes / 2**20
+
+    def numUsed(self):
+        return int(np.count_nonzero((self.entries["data"] >> np.uint64(24)) & np.uint64(255)))
+
+    def clear(self):
+        self.entries.fill(0)
+        self.generation = 0
+
+    # marks the start of a new search so that stale depth-preferred entries can be replaced
+    def newSearch(self):
+        self.generation = (self.generation + 1) & 255
+
+    # returns (value, depth, flag, position, piece) or None
+    def probe(self, key: int):
+        self.probes += 1
+        words = self.words
+        i = (key & self.bucketMask) << 2
+        if words[i] == key:
+            data = words[i + 1]
+        elif words[i + 2] == key:
+            data = words[i + 3]
+        else:
+            data = EMPTY
+        if (data >> 24) & 255 == EMPTY:
+            if self.fallback is not None:
+                return self.fallback.probe(key)
+            return None
+        self.hits += 1
+        return unpackTableData(data)
+
+    def store(self, key: int, value, depth, flag, position, piece):
+        self.stores += 1
+        words = self.words
+        i = (key & self.bucketMask) << 2
+        stored = words[i + 1]
+        if words[i] != key and (stored >> 48) == self.generation and depth < (stored >> 16) & 255:
+            i += 2
+        words[i] = key
+        words[i + 1] = packTableData(value, depth, flag, position, piece, self.generation)
+
+    # yields (key, data) for every used entry
+    def usedEntries(self):
+        words = self.words
+        for i in np.flatnonzero((self.entries["data"] >> np.uint64(24)) & np.uint64(255)):
+            yield words[2 * i], words[2 * i + 1]
+
+    # copies every used entry of another table into this one using the normal replacement policy
+    def mergeFrom(self, other):
+        for key, data in other.usedEntries():
+            value, depth, flag, position, piece = unpackTableData(data)
+            self.store(key, value, depth, flag, position, piece)
 
-    df["encoding"] = df["encoding"].astype("str")
-    df["evaluation"] = df["evaluation"].astype("int8")
-    df["movePos"] = df["movePos"].astype("int8")
-    df["movePiece"] = df["movePiece"].astype("int8")
+    # tables mapped from a file are pickled by path so that worker processes map the same pages instead of copying them
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["words"]
+        if self.path is not None:
+            state["entries"] = bool(self.entries.flags.writeable)
+        return state
 
-    df.to_pickle(f"tables/{file_name}.pkl")
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.path is not None:
+            self.entries = openTableFile(self.path, writable=state["entries"]).entries
+        self.words = memoryview(self.entries.view(np.uint64)).cast("B").cast("Q")
+
+
+# Shared-memory layout - a 4 KB header (number of entries, then one (pid, probes, hits, stores) counter slot per attached
+# process) followed by the entry array. Every process only writes its own counter slot, so no locking is needed.
+SHARED_TABLE_HEADER_SIZE = 4096
+SHARED_TABLE_MAX_WORKERS = (SHARED_TABLE_HEADER_SIZE // 8 - 1) // 4
+
+
+class SharedTranspositionTable(TranspositionTable):
+    """
+    Transposition table in a multiprocessing.shared_memory block that every process on the machine can attach to by name.
+    Writes are lockless - the key word holds key ^ data, so an entry whose two words were written by different processes
+    at the same time fails verification on probe and reads as a miss instead of returning another position's data.
+    The probe/hit/store counters of the base class count this process only (per worker). Each process publishes them to
+    the header at every new search and on detach, and globalStats() sums what all attached processes have published.
+    """
+
+    def __init__(self, sizeMB=DEFAULT_TABLE_SIZE_MB, name=None) -> None:
+        if name is None:
+            numEntries = tableEntriesForSize(sizeMB)
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=SHARED_TABLE_HEADER_SIZE + numEntries * TABLE_ENTRY.itemsize
+            )
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+
+        self.header = np.ndarray(SHARED_TABLE_HEADER_SIZE // 8, dtype=np.uint64, buffer=self.shm.buf)
+        if name is None:
+            self.header[0] = numEntries
+        entries = np.ndarray(
+            int(self.header[0]), dtype=TABLE_ENTRY, buffer=self.shm.buf, offset=SHARED_TABLE_HEADER_SIZE
+        )
+        super().__init__(entries=entries)
+        self.name = self.shm.name
+        self.slot = None
+
+    @classmethod
+    def attach(cls, name: str):
+        return cls(name=name)
+
+    # releases this process's mapping - the block itself lives on until the owner unlinks it
+    def detach(self):
+        if self.shm is None:
+            return
+        self.publishStats()
+        self.words.release()
+        del self.words, self.entries, self.header
+        self.shm.close()
+        self.shm = None
+
+    # detaches and frees the block for every process - only done by the owner once all workers are finished
+    def unlink(self):
+        shm = self.shm
+        self.detach()
+        if self.owner:
+            (shm or shared_memory.SharedMemory(name=self.name)).unlink()
+
+    # pickled by name - unpickling attaches to the same block, so agents sent to worker processes share the table
+    def __getstate__(self):
+        return {"name": self.name, "generation": self.generation, "fallback": self.fallback}
+
+    def __setstate__(self, state):
+        self.__init__(name=state["name"])
+        self.generation = state["generation"]
+        self.fallback = state["fallback"]
+
+    def probe(self, key: int):
+        self.probes += 1
+        words = self.words
+        i = (key & self.bucketMask) << 2
+        data = words[i + 1]
+        if words[i] ^ data != key:
+            data = words[i + 3]
+            if words[i + 2] ^ data != key:
+                data = EMPTY
+        if (data >> 24) & 255 == EMPTY:
+            if self.fallback is not None:
+                return self.fallback.probe(key)
+            return None
+        self.hits += 1
+        return unpackTableData(data)
+
+    def store(self, key: int, value, depth, flag, position, piece):
+        self.stores += 1
+        words = self.words
+        i = (key & self.bucketMask) << 2
+        stored = words[i + 1]
+        if words[i] ^ stored != key and (stored >> 48) == self.generation and depth < (stored >> 16) & 255:
+            i += 2
+        data = packTableData(value, depth, flag, position, piece, self.generation)
+        words[i + 1] = data
+        words[i] = key ^ data
+
+    def usedEntries(self):
+        for key, data in super().usedEntries():
+            yield key ^ data, data
+
+    def newSearch(self):
+        super().newSearch()
+        self.publishStats()
+
+    # writes this process's counters to its slot of the header, claiming a slot on first use
+    # a process attaching again keeps adding to the counters it published before
+    def publishStats(self):
+        header = self.header
+        pid = os.getpid()
+        if self.slot is None or header[1 + 4 * self.slot] != pid:
+            self.slot = None
+            for slot in range(SHARED_TABLE_MAX_WORKERS):
+                if header[1 + 4 * slot] == pid:
+                    self.statsOffset = header[2 + 4 * slot : 5 + 4 * slot].copy()
+                elif header[1 + 4 * slot] == 0:
+                    header[1 + 4 * slot] = pid
+                    self.statsOffset = np.zeros(3, dtype=np.uint64)
+                else:
+                    continue
+                self.slot = slot
+                break
+            if self.slot is None:
+                return
+        header[2 + 4 * self.slot : 5 + 4 * self.slot] = self.statsOffset + np.array(
+            (self.probes, self.hits, self.stores), dtype=np.uint64
+        )
+
+    # (pid, probes, hits, stores) of every process that has published its counters
+    def workerStats(self):
+        self.publishStats()
+        slots = self.header[1 : 1 + 4 * SHARED_TABLE_MAX_WORKERS].reshape(-1, 4)
+        return [tuple(int(x) for x in slot) for slot in slots if slot[0] != 0]
+
+    # (probes, hits, stores) summed over all processes
+    def globalStats(self):
+        stats = self.workerStats()
+        return tuple(sum(slot[i] for slot in stats) for i in (1, 2, 3))
+
+
+# Bounded least-recently-used cache - a hit moves its entry to the back of the eviction order and storing into a full
+# cache evicts the entry at the front. Values must not be None, which get returns on a miss.
+class LRUCache:
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+# Table files
+# A 16-byte header (magic, format version, number of entries) followed by the raw entry array in its hashed layout.
+# The file is opened with mmap, so opening is O(1) for any table size and processes reading the same file share its pages.
+TABLE_FILE_HEADER = np.dtype([("magic", "S4"), ("version", "<u4"), ("numEntries", "<u8")])
+TABLE_FILE_MAGIC = b"QTTB"
+TABLE_FILE_VERSION = 1
+
+
+def getTablePath(file_name: str):
+    return f"tables/{file_name}.qtt"
+
+
+def createTableFile(path: str, sizeMB=DEFAULT_TABLE_SIZE_MB):
+    table = TranspositionTable(sizeMB)
+    header = np.array([(TABLE_FILE_MAGIC, TABLE_FILE_VERSION, len(table))], dtype=TABLE_FILE_HEADER)
+    with open(path, "wb") as f:
+        f.write(header.tobytes())
+        f.write(table.entries.tobytes())
+
+
+def openTableFile(path: str, writable=False):
+    header = np.fromfile(path, dtype=TABLE_FILE_HEADER, count=1)[0]
+    assert header["magic"] == TABLE_FILE_MAGIC, f"{path} is not a transposition table file."
+    assert header["version"] == TABLE_FILE_VERSION, f"Unsupported table file version {header['version']}."
+
+    entries = np.memmap(
+        path,
+        dtype=TABLE_ENTRY,
+        mode="r+" if writable else "r",
+        offset=TABLE_FILE_HEADER.itemsize,
+        shape=(int(header["numEntries"]),),
+    )
+    table = TranspositionTable(entries=entries)
+    table.path = path
+    return table
+
+
+# merges the entries of a table into a table file, creating the file if it does not exist yet
+def mergeIntoTableFile(table, path: str, sizeMB=DEFAULT_TABLE_SIZE_MB):
+    if not os.path.exists(path):
+        createTableFile(path, sizeMB)
+    fileTable = openTableFile(path, writable=True)
+    fileTable.mergeFrom(table)
+    fileTable.entries.flush()
+
+
+def createTable(file_name: str, sizeMB=DEFAULT_TABLE_SIZE_MB):
+    createTableFile(getTablePath(file_name), sizeMB)
+
+
+# Converts a legacy pickled dataframe table (tables/<name>.pkl) to a table file (tables/<name>.qtt)
+# Legacy rows only hold root results of a search of unknown depth, so the depth they were searched to has to be given.
+# Legacy wins were clamped to +-10 and are mapped back to winScore.
+def convertLegacyTable(file_name: str, depth: int, sizeMB=DEFAULT_TABLE_SIZE_MB, winScore=100):
+    legacy = pd.read_pickle(f"tables/{file_name}.pkl")
+    table = TranspositionTable(sizeMB)
+    for encoding, evaluation, movePos, movePiece in legacy[
+        ["encoding", "evaluation", "movePos", "movePiece"]
+    ].itertuples(index=False):
+        state = Bitboard.fromEncoding(encoding)
+        key, transform = state.canonicalKey()
+        evaluation = int(evaluation)
+        if abs(evaluation) == 10:
+            evaluation = winScore if evaluation > 0 else -winScore
+        position, piece = transformMove(transform, int(movePos), int(movePiece))
+        table.store(key, evaluation, depth, EXACT, position, piece)
+    mergeIntoTableFile(table, getTablePath(file_name), sizeMB)
 
 
 # Used to create a pandas dataframe to store results for agents - linked to the name of an agent
@@ -228,6 +1128,20 @@ def readLogFile(filename):
     return (agent1, agent2), data, game_results
 
 
+# yields a Bitboard of every position of the detailed game logs in logDir that is not decided yet
+def loggedPositions(logDir: str):
+    for filename in sorted(os.listdir(logDir)):
+        _, games, _ = readLogFile(f"{logDir}/{filename}")
+        for game in games:
+            for record in game:
+                encoding = record[0]
+                if len(encoding) != 34 or not encoding.isdigit():
+                    continue
+                state = Bitboard.fromEncoding(encoding)
+                if not state.isGameOver():
+                    yield state
+
+
 # Extracts data from summative log file
 def readRunFile(filename):
     log = open(filename)